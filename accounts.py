@@ -0,0 +1,30 @@
+import os
+from pathlib import Path
+
+from fetcher import read_token
+
+# Every account gets its own directory with the files a single account run keeps in the working directory
+ACCOUNTS_DIR = "accounts"
+
+# The subject catalog is the same for every account, so it is fetched and stored once for all of them
+CATALOG_FILE = "subjects.sqlite"
+CATALOG_INDEX_FILE = "subject_index.npz"
+
+
+def read_tokens(token_files):
+    """
+    {account name: token} of the given token files, named after the file without its extension.
+    """
+    tokens = dict()
+    for path in token_files:
+        name = Path(path).stem
+        if name in tokens:
+            raise ValueError(f"Two token files are named {name}")
+        tokens[name] = read_token(path)
+    return tokens
+
+
+def account_dir(name, root=ACCOUNTS_DIR):
+    directory = os.path.join(root, name)
+    os.makedirs(directory, exist_ok=True)
+    return directory
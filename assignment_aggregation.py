@@ -0,0 +1,88 @@
+import datetime
+from collections import defaultdict
+
+import numpy as np
+
+from assignment_archive import ASSIGNMENT_TYPES
+from review_aggregation import SUBJECT_TYPES
+from time_buckets import iso_year_week
+
+
+def bucket_assignments(assignments, today):
+    """
+    Assignment counts by subject type, srs stage and due date (no earlier than today),
+    and by subject type and ISO (year, week) for the started and burned ones, plus every week seen.
+    assignments is an assignment_archive projection.
+    """
+    subject_types = ASSIGNMENT_TYPES
+    types = assignments["subject_type"].astype(np.int64)
+    stages = assignments["srs_stage"].astype(np.int64)
+
+    assignment_due_date_counts_by_subject_and_stage = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    due = assignments["available_at"].astype("M8[D]")
+    has_due = ~np.isnat(due)
+    due = np.maximum(due[has_due].astype("M8[us]"), np.datetime64(today, "us"))
+    # Days, types and stages are combined into one key, which np.unique handles much faster than rows
+    keys, counts = np.unique((due.astype("M8[D]").astype(np.int64) * len(subject_types) + types[has_due]) * 10
+                             + stages[has_due], return_counts=True)
+    days = (keys // 10 // len(subject_types)).astype("M8[D]").astype(datetime.datetime)
+    for day, t, stage, n in zip(days.tolist(), (keys // 10 % len(subject_types)).tolist(), (keys % 10).tolist(),
+                                counts.tolist()):
+        assignment_due_date_counts_by_subject_and_stage[subject_types[t]][stage][
+            datetime.datetime.combine(day, datetime.time())] += n
+
+    all_weeks = set()
+    per_week = []
+    for field in ["started_at", "burned_at"]:
+        weekly = defaultdict(lambda: defaultdict(int))
+        done = ~np.isnat(assignments[field])
+        year, week = iso_year_week(assignments[field][done])
+        keys, counts = np.unique((year * 100 + week) * len(subject_types) + types[done], return_counts=True)
+        for year_and_week, t, n in zip((keys // len(subject_types)).tolist(), (keys % len(subject_types)).tolist(),
+                                       counts.tolist()):
+            y, w = divmod(year_and_week, 100)
+            weekly[subject_types[t]][(y, w)] += n
+            all_weeks.add((y, w))
+        per_week.append(weekly)
+    assingment_started_per_week, assingments_burned_per_week = per_week
+
+    return assignment_due_date_counts_by_subject_and_stage, assingment_started_per_week, \
+        assingments_burned_per_week, all_weeks
+
+
+def due_date_panels(assignment_due_date_counts_by_subject_and_stage):
+    due_dates = dict()
+    for t in SUBJECT_TYPES:
+        panels = []
+        for stages in [range(1, 5), [5], [6], [7], [8]]:
+            data = defaultdict(int)
+            for stage in stages:
+                for k, v in assignment_due_date_counts_by_subject_and_stage[t][stage].items():
+                    data[k] += v
+            panels.append((list(data.keys()), list(data.values())))
+        due_dates[t] = panels
+    return due_dates
+
+
+def started_burned_totals(assingment_started_per_week, assingments_burned_per_week, all_weeks):
+    weekly_totals = dict()
+    for t in SUBJECT_TYPES:
+        total_started = 0
+        total_burned = 0
+        balance = 0
+        weeks = []
+        started_list = []
+        burned_list = []
+        balance_list = []
+        for year_and_week in sorted(all_weeks):
+            started = assingment_started_per_week[t][year_and_week]
+            burned = assingments_burned_per_week[t][year_and_week]
+            total_started += started
+            total_burned += burned
+            balance += started - burned
+            weeks.append(datetime.datetime(int(year_and_week[0]), 1, 1) + datetime.timedelta(weeks=int(year_and_week[1]) - 1))
+            started_list.append(total_started)
+            burned_list.append(total_burned)
+            balance_list.append(balance)
+        weekly_totals[t] = (weeks, started_list, burned_list, balance_list)
+    return weekly_totals
@@ -0,0 +1,166 @@
+import gzip
+import json
+import os
+
+import numpy as np
+
+from persisted_state import save_npz
+from time_buckets import time_column
+
+ASSIGNMENT_TYPES = ["radical", "kanji", "vocabulary", "kana_vocabulary"]
+# Row of every assignment type in the stage counts, kana only vocabulary is counted with the vocabulary
+COUNT_ROWS = np.array([0, 1, 2, 2])
+
+TIME_FIELDS = ["data_updated_at", "unlocked_at", "started_at", "passed_at", "burned_at", "available_at"]
+
+# The columns of an assignment that are actually used, times are NaT where they are null
+ASSIGNMENT_DTYPE = np.dtype([
+    ("id", "<i8"),
+    ("subject_id", "<i4"),
+    ("subject_type", "i1"),
+    ("srs_stage", "i1"),
+] + [(f, "M8[us]") for f in TIME_FIELDS])
+
+LOG_FILE = "assignments.log.gz"
+PROJECTION_FILE = "assignments.npz"
+
+
+def project(assignments):
+    """
+    Assignment documents, or items of raw API pages, as an ASSIGNMENT_DTYPE array.
+    """
+    projection = np.zeros(len(assignments), dtype=ASSIGNMENT_DTYPE)
+    projection["id"] = [a["id"] for a in assignments]
+    projection["subject_id"] = [a["data"]["subject_id"] for a in assignments]
+    projection["subject_type"] = [ASSIGNMENT_TYPES.index(a["data"]["subject_type"]) for a in assignments]
+    projection["srs_stage"] = [a["data"]["srs_stage"] for a in assignments]
+    for f in TIME_FIELDS:
+        projection[f] = time_column(assignments, f)
+    return projection
+
+
+def upsert(projection, rows):
+    # The rows replace the assignments with the same id, the result is sorted by id
+    combined = np.concatenate([projection, rows])
+    # np.unique keeps the first of every id, so it is given the newest rows first
+    _, last = np.unique(combined["id"][::-1], return_index=True)
+    return combined[len(combined) - 1 - last]
+
+
+def stage_counts(projection):
+    # The (subject type x srs stage) counts of a snapshot
+    return np.bincount(COUNT_ROWS[projection["subject_type"]] * 10 + projection["srs_stage"],
+                       minlength=30).reshape(3, 10).astype(np.int32)
+
+
+def append_pages(path, pages, fetched_at):
+    """
+    Appends raw API pages to the log as one gzip member, so the log never has to be rewritten.
+    """
+    with gzip.open(path, "ab") as log:
+        for page in pages:
+            log.write(json.dumps({"fetched_at": fetched_at, "page": page}, separators=(",", ":")).encode("utf-8"))
+            log.write(b"\n")
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def read_log(path):
+    # Yields (fetched_at, page) of every logged page in the order they were appended
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as log:
+            for line in log:
+                record = json.loads(line)
+                yield record["fetched_at"], record["page"]
+    except FileNotFoundError:
+        return
+
+
+def save_projection(path, projection, data_updated_at):
+    save_npz(path, compressed=True, assignments=projection, data_updated_at=np.array(data_updated_at or ""))
+
+
+def load_projection(path=PROJECTION_FILE):
+    # (projection, data_updated_at of the newest page in it) or None when there is no projection yet
+    try:
+        with np.load(path) as saved:
+            return saved["assignments"], str(saved["data_updated_at"]) or None
+    except FileNotFoundError:
+        return None
+
+
+def reproject(log_path=LOG_FILE):
+    """
+    Rebuilds the projection from the complete raw log, e.g. after adding a column.
+    """
+    projection = np.zeros(0, dtype=ASSIGNMENT_DTYPE)
+    data_updated_at = None
+    for fetched_at, page in read_log(log_path):
+        projection = upsert(projection, project(page["data"]))
+        data_updated_at = page.get("data_updated_at") or data_updated_at
+    return projection, data_updated_at
+
+
+def _refuse_non_empty_log(log_path):
+    # The log is replayed in append order, so older data can only be imported before anything else is logged
+    if os.path.exists(log_path) and os.path.getsize(log_path) > 0:
+        raise FileExistsError(f"{log_path} already has pages, older assignments can only be imported into a new log")
+
+
+def import_json(json_path, log_path=LOG_FILE, projection_path=PROJECTION_FILE):
+    """
+    One-time import of out_ass.json ({"data_updated_at": ..., "data": {id: assignment}}) as a single logged page.
+    Refused when there is a projection or a non-empty log already, which would be newer than out_ass.json.
+    """
+    if os.path.exists(projection_path):
+        raise FileExistsError(f"{projection_path} already exists, importing {json_path} would roll it back")
+    _refuse_non_empty_log(log_path)
+    with open(json_path, "r") as f:
+        assignments = json.load(f)
+    page = {"data": list(assignments["data"].values()), "data_updated_at": assignments["data_updated_at"]}
+    append_pages(log_path, [page], None)
+    projection = upsert(np.zeros(0, dtype=ASSIGNMENT_DTYPE), project(page["data"]))
+    save_projection(projection_path, projection, assignments["data_updated_at"])
+    return projection, assignments["data_updated_at"]
+
+
+def import_history(json_path, log_path=LOG_FILE):
+    """
+    One-time import of assignments.json ({date: [assignment, ...]}), logging every date as a fetch at that date.
+    Only into a new log, the collector's pages have to come after the history.
+    """
+    from breakdown_assingnments_json import iter_object_items
+
+    _refuse_non_empty_log(log_path)
+    with open(json_path, "r") as f:
+        for date, assignments in iter_object_items(f):
+            append_pages(log_path, [{"data": assignments, "data_updated_at": None}], date)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compact assignment archive: a gzip log of raw pages "
+                                                 "and a columnar projection of the fields that are used")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("import", help="import out_ass.json")
+    command.add_argument("json_path", nargs="?", default="out_ass.json")
+    command = commands.add_parser("import-history", help="import a dated history like assignments.json")
+    command.add_argument("json_path", nargs="?", default="assignments.json")
+    commands.add_parser("reproject", help="rebuild the projection from the raw log")
+    parser.add_argument("--log", default=LOG_FILE)
+    parser.add_argument("--projection", default=PROJECTION_FILE)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "import":
+            projection, _ = import_json(args.json_path, args.log, args.projection)
+            print(f"Imported {len(projection)} assignments")
+        elif args.command == "import-history":
+            import_history(args.json_path, args.log)
+    except FileExistsError as e:
+        raise SystemExit(str(e))
+    if args.command == "reproject":
+        projection, data_updated_at = reproject(args.log)
+        save_projection(args.projection, projection, data_updated_at)
+        print(f"Projected {len(projection)} assignments")
@@ -0,0 +1,233 @@
+import contextlib
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import figures
+import range_index
+import review_checkpoint
+import review_shards
+import srs_timeline
+import synthetic
+from assignment_archive import project, stage_counts
+from assignment_aggregation import bucket_assignments, due_date_panels, started_burned_totals
+from breakdown_assingnments_json import do_one_instance
+from forecast import forecast_reviews, pass_rates, summarize
+from local_cache import CACHE_FILE, connect, load_review_array, store
+from review_aggregation import SUBJECT_TYPES, stage_history, subject_answers, time_in_stage
+from subject_ranking import rank
+
+
+# The calendar heatmap as it was before it was vectorized, kept as the baseline to compare against
+def legacy_calendar_array(dates, data):
+    i, j = zip(*[[d.isocalendar()[0] * 52 + d.isocalendar()[1], d.isocalendar()[2]] for d in dates])
+    i = np.array(i) - min(i)
+    j = np.array(j) - 1
+    ni = max(i) + 1
+
+    calendar = np.nan * np.zeros((ni, 7))
+    calendar[i, j] = data
+    return i, j, calendar
+
+
+def legacy_calendar_heatmap(ax, dates, data):
+    i, j, calendar = legacy_calendar_array(dates, data)
+    im = ax.imshow(calendar, interpolation='none', cmap='summer')
+    legacy_label_days(ax, data, i, j, calendar)
+    legacy_label_months(ax, dates, i, j, calendar)
+    ax.figure.colorbar(im)
+
+
+def legacy_label_days(ax, dates, i, j, calendar):
+    ni, nj = calendar.shape
+    day_of_month = np.nan * np.zeros((ni, 7))
+    day_of_month[i, j] = [d for d in dates]
+
+    for (i, j), day in np.ndenumerate(day_of_month):
+        if np.isfinite(day):
+            ax.text(j, i, int(day), ha='center', va='center')
+
+    ax.set(xticks=np.arange(7),
+           xticklabels=['M', 'T', 'W', 'T', 'F', 'S', 'S'])
+    ax.xaxis.tick_top()
+
+
+def legacy_label_months(ax, dates, i, j, calendar):
+    month_labels = np.array(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul',
+                             'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
+    months = np.array([d.month for d in dates])
+    uniq_months = sorted(set(months))
+    yticks = [i[months == m].mean() for m in uniq_months]
+    labels = [month_labels[m - 1] for m in uniq_months]
+    ax.set(yticks=yticks)
+    ax.set_yticklabels(labels, rotation=90)
+
+
+def unlabelled_calendar_heatmap(ax, dates, data):
+    dates = np.asarray(dates, dtype="M8[D]")
+    i, j, calendar = figures.calendar_array(dates, data)
+    im = ax.imshow(calendar, interpolation='none', cmap='summer')
+    figures.label_months(ax, dates, i, j, calendar)
+    ax.figure.colorbar(im)
+
+
+def due_date_panel(days, seed):
+    rng = np.random.default_rng(seed)
+    today = datetime.datetime(2024, 1, 1)
+    dates = [today + datetime.timedelta(days=int(d)) for d in np.sort(rng.choice(days, size=days // 2, replace=False))]
+    return dates, rng.integers(1, 200, size=len(dates)).tolist()
+
+
+def time_calendar_figure(heatmap, panels, repeat=3):
+    build = redraw = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fig = Figure(figsize=(17, 12))
+        FigureCanvasAgg(fig)
+        for n, (dates, counts) in enumerate(panels):
+            heatmap(fig.add_subplot(3, 5, n + 1), dates, counts)
+        fig.canvas.draw()
+        build = min(build, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        fig.canvas.draw()
+        redraw = min(redraw, time.perf_counter() - start)
+    return {"build_and_draw_seconds": build, "redraw_seconds": redraw}
+
+
+def benchmark_calendar(days=365):
+    """
+    Times the 15 panel due date figure (num=4) with the legacy and the vectorized calendar heatmap.
+    The unlabelled figure is the cost of the axes, images and colorbars that both share,
+    subtracting it gives the cost of the day labels alone.
+    """
+    panels = [due_date_panel(days, seed) for seed in range(15)]
+    results = {
+        "legacy": time_calendar_figure(legacy_calendar_heatmap, panels),
+        "vectorized": time_calendar_figure(figures.calendar_heatmap, panels),
+        "unlabelled": time_calendar_figure(unlabelled_calendar_heatmap, panels),
+    }
+    for name in ["legacy", "vectorized"]:
+        results[name]["label_seconds"] = {k: results[name][k] - results["unlabelled"][k]
+                                          for k in results["unlabelled"]}
+    return results
+
+
+def timed(timings, name, function, *args, repeat=1):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # Some draw functions print, which would end up in the middle of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    timings[name] = best
+    return result
+
+
+def draw_figure(name, inputs):
+    draw, num, figsize = figures.FIGURES[name]
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    draw(fig, inputs)
+    fig.canvas.draw()
+
+
+def benchmark_pipeline(years, seed=0, repeat=1):
+    """
+    Times every step from the collected data to the drawn figures on a synthetic account of the given years.
+    The figures are drawn but not saved, so disk speed does not count.
+    The *_update and *_extend steps are the refresh of a run a day after the previous one, the other review steps
+    are what a run that rebuilds its states costs.
+    """
+    end = datetime.datetime(2024, 1, 1)
+    data = synthetic.generate(years, seed, start=end - datetime.timedelta(days=365 * years))
+    reviews = data["reviews"]
+    type_codes = np.full(len(data["subjects"]) + 1, -1, dtype=np.int8)
+    type_codes[reviews["subject_id"]] = reviews["subject_type"]
+    day_ago = reviews["timestamp"].max() - np.timedelta64(1, "D")
+    old, new = reviews[reviews["timestamp"] <= day_ago], reviews[reviews["timestamp"] > day_ago]
+
+    timings = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        cache = connect(os.path.join(directory, CACHE_FILE))
+        store(cache, synthetic.review_documents(reviews))
+        timed(timings, "load_review_array", load_review_array, cache, type_codes, repeat=repeat)
+        timed(timings, "load_new_reviews", load_review_array, cache, type_codes, day_ago.item(), repeat=repeat)
+        cache.close()
+    checkpoint = review_checkpoint.build(old, "", workers=1)
+    timed(timings, "checkpoint_update", review_checkpoint.update, checkpoint, new, repeat=repeat)
+    timed(timings, "range_index_extend", range_index.extend, range_index.build(old, ""), new, repeat=repeat)
+    timeline = srs_timeline.build(srs_timeline.review_events(old), type_codes)
+    timed(timings, "srs_timeline_extend", srs_timeline.extend, timeline, srs_timeline.review_events(new),
+          repeat=repeat)
+
+    timed(timings, "do_one_instance", do_one_instance, data["assignments"], SUBJECT_TYPES, repeat=repeat)
+    stage_time = timed(timings, "time_in_stage", time_in_stage, reviews, repeat=repeat)
+    answers = timed(timings, "subject_answers", subject_answers, reviews, repeat=repeat)
+    timed(timings, "rank_subjects", rank, stage_time, answers, repeat=repeat)
+    histories = timed(timings, "stage_history",
+                      lambda: [stage_history(reviews, i) for i in range(len(SUBJECT_TYPES))], repeat=repeat)
+    # time_in_stage, subject_answers and stage_history at once, over time shards in a process per CPU
+    timed(timings, "review_shards", review_shards.aggregate, reviews, repeat=repeat)
+    index = timed(timings, "range_index", range_index.build, reviews, "", repeat=repeat)
+    aggregates = range_index.window_aggregates(index)
+    # Weekly and daily aggregates of the last year, as drawn with a --since window
+    timed(timings, "window_aggregates", range_index.window_aggregates, index, end - datetime.timedelta(days=365), end,
+          repeat=repeat)
+    assignments = timed(timings, "project_assignments", project, data["assignments"], repeat=repeat)
+    timed(timings, "stage_counts", stage_counts, assignments, repeat=repeat)
+    events = np.concatenate([srs_timeline.assignment_events(assignments), srs_timeline.review_events(reviews)])
+    timeline = timed(timings, "srs_timeline", srs_timeline.build, events, type_codes, repeat=repeat)
+    # The stage counts of a past moment, half a year before the end
+    timed(timings, "counts_at", srs_timeline.counts_at, timeline, end - datetime.timedelta(days=182), repeat=repeat)
+    buckets = timed(timings, "bucket_assignments", bucket_assignments, assignments, end, repeat=repeat)
+    due_dates = timed(timings, "due_date_panels", due_date_panels, buckets[0], repeat=repeat)
+    weekly_totals = timed(timings, "started_burned_totals", started_burned_totals, *buckets[1:], repeat=repeat)
+    rates = pass_rates(aggregates["weekly_correct"], aggregates["weekly_wrong"], weeks=12)
+    counts = timed(timings, "forecast_reviews", forecast_reviews, assignments, rates, end, repeat=repeat)
+
+    level_ups = [x["data"]["passed_at"] for x in data["level_progressions"] if x["data"]["passed_at"] is not None]
+    figure_inputs = figures.review_figure_inputs(aggregates, dict(zip(SUBJECT_TYPES, histories)), level_ups)
+    figure_inputs["due_calendars"] = due_dates
+    figure_inputs["started_burned"] = weekly_totals
+    figure_inputs["review_forecast"] = summarize(counts, end)
+    for name, inputs in figure_inputs.items():
+        timed(timings, f"figure_{name}", draw_figure, name, inputs, repeat=repeat)
+
+    return {
+        "years": years,
+        "seed": seed,
+        "reviews": len(reviews),
+        "assignments": len(data["assignments"]),
+        "seconds": timings,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 10],
+                        help="sizes of the synthetic accounts to time the pipeline on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="report the best of this many runs of every step")
+    parser.add_argument("--calendar", action="store_true", help="also compare the calendar heatmap implementations")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = {"pipeline": [benchmark_pipeline(y, args.seed, args.repeat) for y in args.years]}
+    if args.calendar:
+        results["calendar"] = benchmark_calendar()
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
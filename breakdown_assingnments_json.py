@@ -1,10 +1,35 @@
+import itertools
 import json
 
+import numpy as np
 
-def main():
-    subject_types = ["radical", "kanji", "vocabulary"]
+from assignment_archive import ASSIGNMENT_DTYPE, project, read_log, stage_counts, upsert
+from review_aggregation import SUBJECT_TYPES
+from srs_timeline import counts_at, load_timeline
+
+
+def main(stream=False, archive=None, timeline=None):
+    subject_types = SUBJECT_TYPES
+
+    if archive is not None:
+        with open("simplejson_out.json", "w") as out:
+            json.dump(dict(archive_totals(archive, subject_types)), out)
+        return
+
+    if timeline is not None:
+        with open("simplejson_out.json", "w") as out:
+            json.dump(dict(timeline_totals(timeline, subject_types)), out)
+        return
 
     with open("assignments.json") as assin, open("simplejson_out.json", "w") as out:
+        if stream:
+            out.write("{")
+            for i, (date, d) in enumerate(iter_object_items(assin)):
+                daily_totals = do_one_instance(d, subject_types)
+                out.write(f"{', ' if i else ''}{json.dumps(date)}: {json.dumps(daily_totals)}")
+            out.write("}")
+            return
+
         data = json.load(assin)
         out_data = dict()
 
@@ -15,8 +40,105 @@ def main():
         json.dump(out_data, out)
 
 
+def archive_totals(log_path, subject_types):
+    """
+    Yields (fetched_at, daily totals) after every fetch in the raw assignment log, counted from its projection.
+    Only the radical, kanji and vocabulary totals are kept, with kana only vocabulary counted as vocabulary.
+    """
+    projection = np.zeros(0, dtype=ASSIGNMENT_DTYPE)
+    for fetched_at, logged in itertools.groupby(read_log(log_path), key=lambda x: x[0]):
+        pages = [page for _, page in logged]
+        projection = upsert(projection, project([x for page in pages for x in page["data"]]))
+        counts = stage_counts(projection)
+        date = fetched_at or pages[-1]["data_updated_at"]
+        yield date, {t: {str(x): n for x, n in enumerate(counts[i].tolist())}
+                     for i, t in enumerate(SUBJECT_TYPES) if t in subject_types}
+
+
+def timeline_totals(path, subject_types):
+    """
+    Yields (date, daily totals) at the end of every day of an srs_timeline, each reconstructed from the keyframe
+    before it, so no daily assignment dumps are needed.
+    """
+    timeline = load_timeline(path)
+    if timeline is None or len(timeline["events"]) == 0:
+        return
+    times = timeline["events"]["time"]
+    for day in np.arange(times[0].astype("M8[D]"), times[-1].astype("M8[D]") + 1):
+        counts = counts_at(timeline, (day + 1).astype("M8[us]") - 1)
+        yield str(day), {t: {str(x): n for x, n in enumerate(counts[i].tolist())}
+                         for i, t in enumerate(SUBJECT_TYPES) if t in subject_types}
+
+
+def iter_object_items(f, chunk_size=1 << 20):
+    """
+    Yields the key, value pairs of the top level JSON object in f one at a time,
+    so only a single value has to be kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+
+    def fill():
+        nonlocal buffer, position
+        # Read at least as much as is still buffered so that re-parsing a large value stays linear
+        more = f.read(max(chunk_size, len(buffer) - position))
+        if not more:
+            raise ValueError("Unexpected end of JSON input")
+        buffer = buffer[position:] + more
+        position = 0
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return
+            fill()
+
+    def next_char():
+        nonlocal position
+        skip_whitespace()
+        position += 1
+        return buffer[position - 1]
+
+    def next_value():
+        nonlocal position
+        while True:
+            skip_whitespace()
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                fill()
+                continue
+            # A value that ends exactly at the end of the buffer might continue in the next chunk
+            if end == len(buffer):
+                fill()
+                continue
+            position = end
+            return value
+
+    if next_char() != "{":
+        raise ValueError("Expected a JSON object")
+    separator = next_char()
+    while separator != "}":
+        if separator != "," and separator != "\"":
+            raise ValueError(f"Unexpected character {separator!r}")
+        if separator == "\"":
+            position -= 1
+        key = next_value()
+        if next_char() != ":":
+            raise ValueError(f"Expected ':' after {key!r}")
+        yield key, next_value()
+        separator = next_char()
+
+
 def do_one_instance(d, subject_types):
-    daily_totals = {t: {str(x): 0 for x in range(0, 10)} for t in subject_types}
+    index = {t: i for i, t in enumerate(subject_types)}
+    if "vocabulary" in index:
+        index["kana_vocabulary"] = index["vocabulary"]
+    counts = [[0 for x in range(0, 10)] for t in subject_types]
     for subject in d:
         """
         {
@@ -39,12 +161,19 @@ def do_one_instance(d, subject_types):
           }
         }
         """
-        data_subject_type_ = subject["data"]["subject_type"]
-        if data_subject_type_ == "kana_vocabulary":
-            data_subject_type_ = "vocabulary"
-        daily_totals[data_subject_type_][str(subject["data"]["srs_stage"])] += 1
-    return daily_totals
+        counts[index[subject["data"]["subject_type"]]][subject["data"]["srs_stage"]] += 1
+    return {t: {str(x): n for x, n in enumerate(c)} for t, c in zip(subject_types, counts)}
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stream", action="store_true",
+                        help="parse assignments.json one date at a time instead of loading it whole")
+    parser.add_argument("--archive", metavar="LOG",
+                        help="count the fetches in an assignment archive log (e.g. assignments.log.gz) instead")
+    parser.add_argument("--timeline", metavar="NPZ",
+                        help="count the end of every day of an srs timeline (e.g. srs_timeline.npz) instead")
+    args = parser.parse_args()
+    main(args.stream, args.archive, args.timeline)
@@ -1,9 +1,10 @@
-import json
-import datetime
-
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from downsample import downsample, figure_pixels
+from review_aggregation import SUBJECT_TYPES
+from snapshot_store import load_json_snapshots, load_snapshots
+
 colors = [
     "black",
     "xkcd:dark red",
@@ -19,27 +20,21 @@ colors = [
 ]
 
 
-def do_chart():
-    with open("wanikani_perf.json") as d:
-        data = json.load(d)
+def do_chart(store="wanikani_perf.snapshots"):
+    # A JSON history that has not been imported into a snapshot store yet is read in one pass
+    data = load_json_snapshots(store) if store.endswith(".json") else load_snapshots(store)
+    f = data["timestamp"]
 
     fig = plt.figure(figsize=[8, 13])
-    for i, t in enumerate(["radical", "kanji", "vocabulary"]):
+    for i, t in enumerate(SUBJECT_TYPES):
         ax = fig.add_subplot(311 + i)
         ax.set_title(t.capitalize())
         labels = []
         for x in range(1, 10):
-            f = []
-            s = []
-            for k, v in data.items():
-                f.append(datetime.datetime.fromisoformat(k))
-                try:
-                    s.append(v[t][f"{x}"])
-                except KeyError:
-                    s.append(0)
-            if not any(a != 0 for a in s):
+            s = data["counts"][:, i, x]
+            if not s.any():
                 continue
-            ax.plot(f, s, color=colors[x])
+            ax.plot(*downsample(f, s, figure_pixels(fig)), color=colors[x])
             labels.append(str(x))
         ax.legend(labels, loc="upper left", ncol=4)
         ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
@@ -47,4 +42,9 @@ def do_chart():
 
 
 if __name__ == '__main__':
-    do_chart()
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store", nargs="?", default="wanikani_perf.snapshots",
+                        help="snapshot store, or a JSON history like wanikani_perf.json")
+    do_chart(parser.parse_args().store)
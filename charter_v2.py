@@ -1,514 +1,283 @@
 from __future__ import annotations
 
 import datetime
-from collections import defaultdict
-from pathlib import Path
-from typing import Iterable
+import os
 
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import matplotlib
 import numpy as np
-
-from wanikani_api import UserHandle
-
-from breakdown_assingnments_json import do_one_instance
-
-import json
-
-colors = [
-    "black",
-    "xkcd:dark red",
-    "red",
-    "orange",
-    "xkcd:pink",
-    "xkcd:lime",
-    "green",
-    "xkcd:dark green",
-    "xkcd:cyan",
-    "xkcd:blue",
-    "xkcd:dark blue",
-]
-
-temp = (Path(__file__) / ".." / "wanikani_token").resolve()
-with open(temp, "r") as temp_file:
-    wanikani_token = temp_file.read()
-
-
-def iso_year_week_date_to_week_date(iso_year, iso_week, iso_day, current_year):
-    return [iso_year * 52 + iso_week, iso_day]
-
-
-def calendar_array(dates, data):
-    current_year = datetime.datetime.now().isocalendar()[0]
-    i, j = zip(*[iso_year_week_date_to_week_date(*d.isocalendar()[:], current_year) for d in dates])
-    i = np.array(i) - min(i)
-    j = np.array(j) - 1
-    ni = max(i) + 1
-
-    calendar = np.nan * np.zeros((ni, 7))
-    calendar[i, j] = data
-    return i, j, calendar
-
-
-def calendar_heatmap(ax, dates, data):
-    i, j, calendar = calendar_array(dates, data)
-    im = ax.imshow(calendar, interpolation='none', cmap='summer')
-    label_days(ax, data, i, j, calendar)
-    label_months(ax, dates, i, j, calendar)
-    ax.figure.colorbar(im)
-
-
-def label_days(ax, dates, i, j, calendar):
-    ni, nj = calendar.shape
-    day_of_month = np.nan * np.zeros((ni, 7))
-    day_of_month[i, j] = [d for d in dates]
-
-    for (i, j), day in np.ndenumerate(day_of_month):
-        if np.isfinite(day):
-            ax.text(j, i, int(day), ha='center', va='center')
-
-    ax.set(xticks=np.arange(7),
-           xticklabels=['M', 'T', 'W', 'T', 'F', 'S', 'S'])
-    ax.xaxis.tick_top()
-
-
-def label_months(ax, dates, i, j, calendar):
-    month_labels = np.array(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul',
-                             'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
-    months = np.array([d.month for d in dates])
-    uniq_months = sorted(set(months))
-    yticks = [i[months == m].mean() for m in uniq_months]
-    labels = [month_labels[m - 1] for m in uniq_months]
-    ax.set(yticks=yticks)
-    ax.set_yticklabels(labels, rotation=90)
-
-
-def get_subjects(user: UserHandle):
-    cached = {int(x["id"]): x
-              for x in user._subject_cache.find({"object": {"$in": ["radical", "kanji", "vocabulary"]}})}
-    if len(cached) > 1000:
-        return cached
-
-    subjects = user.get_subjects()
-    temp2 = [x for x in subjects]
-    for k in temp2:
-        k["_id"] = str(k["_id"])
-    s = {int(x["id"]): x for x in temp2}
-    return s
-
-
-def get_levels(user: UserHandle, last_updated: datetime.datetime):
-    up = user.get_level_progressions(updated_after=last_updated)
-    print(f"updated {len([x for x in up])} levels")
-    return [x for x in user._personal_cache.find({"object": "level_progression"})]
-
-
-def get_reviews(user: UserHandle, last_updated: datetime.datetime):
-    up = user.get_reviews(updated_after=last_updated)
-    print(f"updated {len([x for x in up])} reviews")
-    return [x for x in user._personal_cache.find({"object": "review"})]
-
-
-def get_assignments(user: UserHandle, last_updated: datetime.datetime):
-    up = user.get_assignments(updated_after=last_updated)
-    print(f"updated {len([x for x in up])} assignments")
-    return [x for x in user._personal_cache.find({"object": "assignment"})]
-
-
-def main():
+import urllib3
+
+from accounts import ACCOUNTS_DIR, CATALOG_FILE, CATALOG_INDEX_FILE, account_dir, read_tokens
+from assignment_archive import ASSIGNMENT_DTYPE, load_projection, project, save_projection, stage_counts, upsert
+from assignment_aggregation import bucket_assignments, due_date_panels, started_burned_totals
+from fetcher import API_URL, RateLimiter, fetch_all, fetch_collection, read_token, run_concurrently
+from forecast import forecast_reviews, pass_rates, summarize
+from figures import render_figures, review_figure_inputs, show_figures
+from local_cache import CACHE_FILE, connect, load, load_reviews_after, store, subjects_updated_at
+from profiling import stage
+from range_index import RANGE_INDEX_FILE, advance as advance_range_index, load_current as load_range_index, \
+    window_aggregates
+from review_aggregation import SUBJECT_TYPES
+from review_checkpoint import CHECKPOINT_FILE, advance as advance_checkpoint, load_current as load_checkpoint
+from subject_index import SubjectStore, load_index
+from subject_ranking import STAGE_GROUPS, format_rankings, parse_stage_groups, rank
+from snapshot_store import append_snapshot, load_snapshots
+from srs_timeline import TIMELINE_FILE, advance as advance_timeline, load_current as load_timeline
+
+ASSIGNMENTS_PROJECTION = "charter_assignments.npz"
+SNAPSHOT_FILE = "simplejson_out.snapshots"
+LAST_DONE_FILE = "last_done.txt"
+
+# The collections fetched per account in batch mode, the subjects are fetched once into the shared catalog
+ACCOUNT_COLLECTIONS = ["reviews", "assignments", "level_progressions"]
+
+# Weeks shown by the weekly stage accuracy when no window is given, eleven bars a week only fit about a year
+RECENT_WEEKS = 52
+
+
+def update_projection(cache, changed, path=ASSIGNMENTS_PROJECTION):
+    # The projection is built from the cached documents once and only has the changes applied after that
+    loaded = load_projection(path)
+    if loaded is None:
+        assignments = upsert(np.zeros(0, dtype=ASSIGNMENT_DTYPE), project(load(cache, "assignment")))
+    else:
+        assignments = upsert(loaded[0], project(changed))
+    save_projection(path, assignments, None)
+    return assignments
+
+
+def _updated_after(url, last_updated):
+    return url if last_updated is None else f"{url}?updated_after={last_updated}Z"
+
+
+def update_catalog(http, limiter, token, path=CATALOG_FILE):
+    catalog = connect(path)
+    url = _updated_after(f"{API_URL}/subjects", subjects_updated_at(catalog))
+    print(f"updated {store(catalog, fetch_collection(http, limiter, token, url))} subjects")
+
+
+def fetch_account(http, limiter, token, directory, last_updated):
+    """
+    Fetches the changes of one account into the cache in its directory.
+    Returns its level progressions and assignment projection.
+    """
+    since = None if last_updated is None else last_updated.isoformat()
+    fetched = fetch_all(token, {name: _updated_after(f"{API_URL}/{name}", since) for name in ACCOUNT_COLLECTIONS},
+                        http, limiter)
+    cache = connect(os.path.join(directory, CACHE_FILE))
+    print(f"{directory}: updated {store(cache, fetched['reviews'])} reviews")
+    print(f"{directory}: updated {store(cache, fetched['level_progressions'])} levels")
+    print(f"{directory}: updated {store(cache, fetched['assignments'])} assignments")
+    assignments = update_projection(cache, fetched["assignments"], os.path.join(directory, ASSIGNMENTS_PROJECTION))
+    return {"levels": load(cache, "level_progression"), "assignments": assignments}
+
+
+def read_last_done(path=LAST_DONE_FILE):
     try:
-        with open("last_done.txt") as l:
-            last_done = datetime.datetime.fromisoformat(l.read())
+        with open(path) as l:
+            return datetime.datetime.fromisoformat(l.read())
     except FileNotFoundError:
-        last_done = None
-
-    user = UserHandle(wanikani_token)
-    data = get_reviews(user=user, last_updated=last_done)
-    subjects = get_subjects(user)
-    subjects = {int(k): v for k, v in subjects.items()}
-
-    level_ups = get_levels(user, last_done)
-
-    assignments = get_assignments(user, last_updated=last_done)
-    with open("simplejson_out.json", "r") as f:
-        old = json.load(f)
-        temp = assignments.copy()
-        for a in temp:
-            del a["_id"]
-        temp = do_one_instance(temp, ["radical", "kanji", "vocabulary"])
-        old[str(datetime.datetime.utcnow())] = temp
-    with open("simplejson_out.json", "w") as f:
-        json.dump(old, f, default=str)
-
-    hourly_data = defaultdict(lambda: defaultdict(dict))
-    hourly_answer_ratio = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    subject_spent_on_stage = defaultdict(lambda: defaultdict(float))
-    subject_previous_completion = dict()
-    weekly_wrong_answers_by_starting_level = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    weekly_correct_answers_by_starting_level = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    daily_level_change = defaultdict(lambda: defaultdict(int))
-    daily_review_count = defaultdict(lambda: defaultdict(int))
-    for r in data:
-        # {"_id": "6366400b421d07cd976aeff9", "id": 2751167231, "object": "review",
-        # "data": {"created_at": "2022-08-15T13:49:17.663000",
-        #          "assignment_id": 303237383,
-        #          "subject_id": 8,
-        #          "spaced_repetition_system_id": 2,
-        #          "starting_srs_stage": 1,
-        #          "ending_srs_stage": 2,
-        #          "incorrect_meaning_answers": 0, "incorrect_reading_answers": 0},
-        # "data_updated_at": "2022-08-15T13:49:17.682000", "url": "https://api.wanikani.com/v2/reviews/2751167231"},
-        d = r["data"]
-        date_and_hour: datetime.datetime = r["data_updated_at"]
-        date_and_hour -= datetime.timedelta(minutes=date_and_hour.minute, seconds=date_and_hour.second,
-                                            microseconds=date_and_hour.microsecond)
-        date = date_and_hour - datetime.timedelta(hours=date_and_hour.hour)
-
-        object_type = subjects[int(d["subject_id"])]["object"]
-
-        ending_srs_stage = d["ending_srs_stage"]
-
-        hourly_data[object_type][date_and_hour][d["subject_id"]] = ending_srs_stage
-        hourly_answer_ratio[object_type][date_and_hour]["meaning_answers"] += d["incorrect_meaning_answers"] + 1
-        hourly_answer_ratio[object_type][date_and_hour]["incorrect_meaning_answers"] += d["incorrect_meaning_answers"]
-        hourly_answer_ratio[object_type][date_and_hour]["reading_answers"] += d["incorrect_reading_answers"] + 1
-        hourly_answer_ratio[object_type][date_and_hour]["incorrect_reading_answers"] += d["incorrect_reading_answers"]
-
-        if d["starting_srs_stage"] >= d["ending_srs_stage"]:
-            weekly_wrong_answers_by_starting_level \
-                [object_type][(date_and_hour.isocalendar().year, date_and_hour.isocalendar().week)][
-                d["starting_srs_stage"]] += 1
+        return None
+
+
+def main(out_dir=None, formats=("png",), workers=None, since=None, until=None, top=20, stage_groups=STAGE_GROUPS):
+    last_done = read_last_done()
+
+    with stage("fetch"):
+        # One account in the current directory, with the subjects in its own cache instead of a shared catalog
+        token = read_token()
+        http = urllib3.PoolManager(maxsize=len(ACCOUNT_COLLECTIONS))
+        limiter = RateLimiter()
+        update_catalog(http, limiter, token, CACHE_FILE)
+        fetched = fetch_account(http, limiter, token, "", last_done)
+
+    with stage("cache_read"):
+        # Reviews are read after the subjects are in the cache, so that the subject index covers them
+        cache = connect()
+        subject_index = load_index(cache)
+        subjects = SubjectStore(cache)
+
+    chart(cache, subject_index, subjects, fetched["levels"], fetched["assignments"], out_dir, formats, workers,
+          since=since, until=until, top=top, stage_groups=stage_groups)
+
+
+def main_batch(token_files, out_dir=None, formats=("png",), workers=None, jobs=None, root=ACCOUNTS_DIR, since=None,
+               until=None, top=20, stage_groups=STAGE_GROUPS):
+    """
+    Charts every account of token_files, each in its own directory under root, with its figures in
+    out_dir/<account> or root/<account>/figures. The subject catalog is fetched once and shared by all of them.
+    The accounts are fetched at the same time, jobs at a time, each with the rate limit of its own token;
+    they are charted one after the other so only one account's data is in memory at a time.
+    """
+    tokens = read_tokens(token_files)
+    directories = {name: account_dir(name, root) for name in tokens}
+    last_done = {name: read_last_done(os.path.join(d, LAST_DONE_FILE)) for name, d in directories.items()}
+    limiters = {name: RateLimiter() for name in tokens}
+    http = urllib3.PoolManager(maxsize=(jobs or len(tokens) + 1) * len(ACCOUNT_COLLECTIONS))
+    catalog_path = os.path.join(root, CATALOG_FILE)
+
+    with stage("fetch"):
+        # The catalog is fetched with the first token, and counts against its rate limit
+        first = next(iter(tokens))
+        fetch_jobs = {None: lambda: update_catalog(http, limiters[first], tokens[first], catalog_path)}
+        fetch_jobs.update({name: (lambda n=name: fetch_account(http, limiters[n], tokens[n], directories[n],
+                                                               last_done[n]))
+                           for name in tokens})
+        loaded = run_concurrently(fetch_jobs, jobs)
+
+    with stage("cache_read"):
+        catalog = connect(catalog_path)
+        subject_index = load_index(catalog, os.path.join(root, CATALOG_INDEX_FILE))
+        subjects = SubjectStore(catalog)
+
+    for name, directory in directories.items():
+        with stage(name):
+            cache = connect(os.path.join(directory, CACHE_FILE))
+            account_out_dir = os.path.join(directory, "figures") if out_dir is None else os.path.join(out_dir, name)
+            chart(cache, subject_index, subjects, loaded[name]["levels"], loaded[name]["assignments"],
+                  account_out_dir, formats, workers, directory, since, until, top, stage_groups)
+
+
+def _in_window(times, since, until):
+    times = np.asarray(times, dtype="M8[us]")
+    shown = np.ones(len(times), dtype=bool)
+    if since is not None:
+        shown &= times >= np.datetime64(since, "us")
+    if until is not None:
+        shown &= times < np.datetime64(until, "us")
+    return shown
+
+
+def chart(cache, subject_index, subjects, level_ups, assignments, out_dir=None, formats=("png",), workers=None,
+          directory="", since=None, until=None, top=20, stage_groups=STAGE_GROUPS):
+    """
+    Everything after the fetch for one account whose files are in directory.
+    subject_index and subjects can come from another cache than the account's reviews, like the shared catalog.
+    The review figures and stage lines only show the time from since up to until, both optional.
+    The top subjects with the most time in each of stage_groups and the worst leeches are printed.
+    """
+    with stage("snapshot"):
+        snapshot_file = os.path.join(directory, SNAPSHOT_FILE)
+        append_snapshot(snapshot_file, datetime.datetime.utcnow(), stage_counts(assignments))
+        old = load_snapshots(snapshot_file)
+
+    with stage("aggregate"):
+        # The reviews cached since the oldest of the three watermarks are read once and added to each
+        paths = {name: os.path.join(directory, f) for name, f in
+                 [("checkpoint", CHECKPOINT_FILE), ("range_index", RANGE_INDEX_FILE), ("timeline", TIMELINE_FILE)]}
+        checkpoint = load_checkpoint(subject_index, paths["checkpoint"])
+        range_index = load_range_index(subject_index, paths["range_index"])
+        timeline = load_timeline(subject_index, paths["timeline"])
+        watermarks = [None if x is None else x["watermark"] for x in [checkpoint, range_index, timeline]]
+        reviews = load_reviews_after(cache, subject_index["type_code"], watermarks)
+
+        checkpoint = advance_checkpoint(checkpoint, reviews, subject_index, paths["checkpoint"])
+        subject_spent_on_stage = checkpoint["time_in_stage"]
+
+        # The windows of the figures are summed from the prefix sums of the range index instead of the reviews
+        range_index = advance_range_index(range_index, reviews, subject_index, paths["range_index"])
+        window = window_aggregates(range_index, since, until)
+        if since is None and not np.isnat(range_index["watermark"]):
+            recent_until = range_index["watermark"] if until is None else np.datetime64(until, "us")
+            recent = window_aggregates(range_index, recent_until - np.timedelta64(RECENT_WEEKS, "W"), until)
         else:
-            weekly_correct_answers_by_starting_level \
-                [object_type][(date_and_hour.isocalendar().year, date_and_hour.isocalendar().week)][
-                d["starting_srs_stage"]] += 1
-
-        if d["subject_id"] in subject_previous_completion:
-            subject_spent_on_stage[d["subject_id"]][d["starting_srs_stage"]] \
-                += (date_and_hour - subject_previous_completion[d["subject_id"]]).total_seconds() / 60
-        subject_previous_completion[d["subject_id"]] = date_and_hour
-
-        daily_review_count[object_type][date] += 1
-        daily_level_change[object_type][date] += d["ending_srs_stage"] - d["starting_srs_stage"]
-
-    accumulated = dict()
-    object_types = ["radical", "kanji", "vocabulary"]
-    for t in object_types:
-        accumulated[t] = dict()
-        keys = sorted(hourly_data[t].keys())
-        current_states = dict()
-        for k in keys:
-            totals = [0 for x in range(10)]
-            for subject_id, srs_stage in hourly_data[t][k].items():
-                current_states[subject_id] = srs_stage
-            for stage in current_states.values():
-                totals[stage] += 1
-            accumulated[t][k] = totals
-
-    for date, data in old.items():
-        date = datetime.datetime.fromisoformat(date)
-        for o_t in object_types:
-            accumulated[o_t][date] = [data[o_t][str(x)] for x in range(0, 10)]
-
-    accumulated_accuracy = dict()
-    for t in object_types:
-        accumulated_accuracy[t] = defaultdict(lambda: defaultdict(int))
-        keys: Iterable[datetime.datetime] = sorted(hourly_answer_ratio[t].keys())
-        for k in keys:
-            week = k.isocalendar().week
-            year = k.isocalendar().year
-            for answer_type in ["meaning_answers", "incorrect_meaning_answers",
-                                "reading_answers", "incorrect_reading_answers"]:
-                accumulated_accuracy[t][(year, week)][answer_type] += hourly_answer_ratio[t][k][answer_type]
-
-    fig = plt.figure(num=0, figsize=[15, 13])
-    for i, t in enumerate(object_types):
-        ax = fig.add_subplot(311 + i)
-        ax.set_title(t.capitalize())
-        labels = []
-        xticks = []
-        place = 0
-        coloring = {
-            "meaning_answers": "orange",
-            "reading_answers": "blue"
-        }
-        for (year, week), weekly_data in accumulated_accuracy[t].items():
-            for m in ["reading_answers", "meaning_answers"]:
-                if t == "radical" and m == "reading_answers":
-                    continue
-                place += 1
-                if weekly_data[m] == 0:
-                    continue
-                ax.bar(place, 1 - weekly_data[f"incorrect_{m}"] / weekly_data[m], color=coloring[m], width=1)
-                ax.annotate(f'{weekly_data[m] - weekly_data[f"incorrect_{m}"]}\n/\n{weekly_data[m]}',
-                            (place, 0.5),
-                            (place, 0.5),
-                            horizontalalignment="center",
-                            color="black" if m == "meaning_answers" else "white")
-            xticks.append(place if t == "radical" else place - 0.5)
-            labels.append(f"{year}\nw{week}")
-            place += 0.5
-        ax.set_xticks(xticks)
-        ax.set_xticklabels(labels)
-
-        ax.set_yticks([x / 10 for x in range(0, 11)])
-        ax.set_yticklabels([f"{x * 10}%" for x in range(0, 11)])
-
-        ax.yaxis.grid(True)
-        if t == "radical":
-            ax.legend(["meaning"], loc="lower left")
+            recent = window
+
+        accumulated = dict()
+        for i, t in enumerate(SUBJECT_TYPES):
+            hours, totals = checkpoint["histories"][i]
+            times = np.concatenate([hours, old["timestamp"]])
+            shown = _in_window(times, since, until)
+            accumulated[t] = (times[shown], np.concatenate([totals, old["counts"][:, i]])[shown])
+
+        passed = [x["data"]["passed_at"] for x in level_ups if x["data"]["passed_at"] is not None]
+        passed = [p for p, shown in zip(passed, _in_window(passed, since, until)) if shown]
+        figure_inputs = review_figure_inputs(window, accumulated, passed, recent)
+
+    with stage("timeline"):
+        # Extended with the new reviews, unlocks and lessons, so the state at any past time can be queried
+        advance_timeline(timeline, reviews, assignments, subject_index, paths["timeline"])
+        del reviews
+
+    with stage("slowest_subjects"):
+        rankings = rank(subject_spent_on_stage, checkpoint["subject_answers"], top, stage_groups)
+        print(format_rankings(rankings, subjects))
+
+    with stage("assignments"):
+        today = datetime.datetime.now()
+        today -= datetime.timedelta(seconds=today.second,
+                                    hours=today.hour,
+                                    minutes=today.minute,
+                                    microseconds=today.microsecond)
+        due_counts, started_per_week, burned_per_week, all_weeks = bucket_assignments(assignments, today)
+        figure_inputs["due_calendars"] = due_date_panels(due_counts)
+        figure_inputs["started_burned"] = started_burned_totals(started_per_week, burned_per_week, all_weeks)
+
+    with stage("forecast"):
+        # Recent accuracy predicts the coming months better than the whole history
+        weekly = window if since is None and until is None else window_aggregates(range_index)
+        rates = pass_rates(weekly["weekly_correct"], weekly["weekly_wrong"], weeks=12)
+        now = datetime.datetime.utcnow()
+        figure_inputs["review_forecast"] = summarize(forecast_reviews(assignments, rates, now, seed=0), now)
+
+    with stage("render"):
+        if out_dir is None:
+            show_figures(figure_inputs)
+            # plt.waitforbuttonpress()
         else:
-            ax.legend(["meaning", "reading"], loc="lower left")
-    fig.show()
-
-    for o in object_types:
-        for day in daily_review_count[o]:
-            daily_level_change[o][day] /= daily_review_count[o][day]
-
-    fig = plt.figure(num=5, figsize=[10, 13])
-    for i, t in enumerate(object_types):
-        ax = fig.add_subplot(311 + i)
-        ax.set_title(t.capitalize())
-        ax.plot(daily_level_change[t].keys(), daily_level_change[t].values())
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
-
-    fig.show()
-
-    window_width = 7
-    fig = plt.figure(num=6, figsize=[10, 13])
-    for i, t in enumerate(object_types):
-        ax = fig.add_subplot(311 + i)
-        ax.set_title(t.capitalize())
-        cum_sum = np.cumsum(np.insert([x for x in daily_level_change[t].values()], 0, 0))
-        ma_vec = (cum_sum[window_width:] - cum_sum[:-window_width]) / window_width
-        ax.plot([x for x in daily_level_change[t].keys()][window_width // 2:-((window_width - 1) // 2)], ma_vec)
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
-
-    fig.show()
-
-    fig = plt.figure(num=1, figsize=[10, 13])
-    for i, t in enumerate(object_types):
-        has_data = [False for x in range(10)]
-        ax = fig.add_subplot(311 + i)
-        ax.set_title(t.capitalize())
-        labels = []
-        maximum = 0
-        for x in range(1, 10):
-            f = []
-            s = []
-            for k, v in accumulated[t].items():
-                if v[x] == 0 and not has_data[x]:
-                    if len(f) == 0:
-                        f.append(k)
-                        s.append(0)
-                    else:
-                        f[0] = k
-                    continue
-                f.append(k)
-                s.append(v[x])
-                maximum = max(maximum, v[x])
-                has_data[x] = True
-            if not any(a != 0 for a in s):
-                continue
-            ax.plot(f, s, color=colors[x])
-            labels.append(str(x))
-        ax.legend(labels, loc="upper left", ncol=3 if has_data[9] else 4)
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
-        ax.vlines([x["data"]["passed_at"] for x in level_ups], 0, maximum, linestyles="dashed", zorder=-1)
-        print(maximum)
-    fig.show()
-
-    fig = plt.figure(num=2, figsize=[12, 13])
-    for i, t in enumerate(object_types):
-        ax = fig.add_subplot(311 + i)
-        ax.set_title(t.capitalize())
-        place = 0
-        legend = [_ for _ in range(1, 9)]
-        labels = []
-        for k, v in weekly_correct_answers_by_starting_level[t].items():
-            if k[0] != 2023:
-                continue
-
-            labels.append(f"{k[0]}\nw{k[1]}")
-            place += 2
-            correct = [0 for x in range(10)]
-            total = [0 for x in range(10)]
-            for x in range(1, 10):
-                correct[x] += v[x]
-                total[x] += v[x] + weekly_wrong_answers_by_starting_level[t][k][x]
-
-                if total[x] > 0:
-                    legend[x - 1] = ax.bar(place, correct[x] / total[x], color=colors[x], width=1)
-                place += 1
-
-        ax.legend(legend, [x for x in range(1, 9)], ncol=9, loc="lower center")
-        ax.set_xticks([x * 11 + 5.5 for x in range(len(labels))])
-        ax.set_xticklabels(labels)
-        ax.set_yticks([x / 10 for x in range(0, 11)])
-        ax.set_yticklabels([f"{x * 10}%" for x in range(0, 11)])
-        ax.yaxis.grid(True)
-        ax.set_ybound(0, 1.05)
-    fig.show()
-
-    apprentice = list()
-    guru = list()
-    master = list()
-    enlightened = list()
-    burned = list()
-    for subject, d in subject_spent_on_stage.items():
-        apprentice.append((subject, sum(d[x] for x in range(1, 5))))
-        guru.append((subject, sum(d[x] for x in range(5, 7))))
-        master.append((subject, sum(d[x] for x in range(7, 8))))
-        enlightened.append((subject, sum(d[x] for x in range(8, 9))))
-        burned.append((subject, sum(d[x] for x in range(9, 10))))
-
-    apprentice.sort(key=lambda x: x[1], reverse=True)
-    guru.sort(key=lambda x: x[1], reverse=True)
-    master.sort(key=lambda x: x[1], reverse=True)
-    enlightened.sort(key=lambda x: x[1], reverse=True)
-    burned.sort(key=lambda x: x[1], reverse=True)
-
-    for k in [apprentice, guru, master, enlightened, burned]:
-        for (subject, time) in k[:20]:
-            print(f"{time} {subjects[subject]} ")
-        print()
-
-    today = datetime.datetime.now()
-    today -= datetime.timedelta(seconds=today.second,
-                                hours=today.hour,
-                                minutes=today.minute,
-                                microseconds=today.microsecond)
-    assignment_due_date_counts_by_subject_and_stage = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    assingment_started_per_week = defaultdict(lambda: defaultdict(int))
-    assingments_burned_per_week = defaultdict(lambda: defaultdict(int))
-    all_weeks = set()
-    for a in assignments:
-        """
-        {
-          "id": 80463006,
-          "object": "assignment",
-          "url": "https://api.wanikani.com/v2/assignments/80463006",
-          "data_updated_at": "2017-10-30T01:51:10.438432Z",
-          "data": {
-            "created_at": "2017-09-05T23:38:10.695133Z",
-            "subject_id": 8761,
-            "subject_type": "radical",
-            "srs_stage": 8,
-            "unlocked_at": "2017-09-05T23:38:10.695133Z",
-            "started_at": "2017-09-05T23:41:28.980679Z",
-            "passed_at": "2017-09-07T17:14:14.491889Z",
-            "burned_at": null,
-            "available_at": "2018-02-27T00:00:00.000000Z",
-            "resurrected_at": null,
-            "hidden": false
-          }
-        }
-        """
-        due_date = a["data"]["available_at"]
-        if due_date is not None:
-            due_date -= datetime.timedelta(hours=due_date.hour,
-                                           minutes=due_date.minute,
-                                           seconds=due_date.second,
-                                           microseconds=due_date.microsecond)
-            due_date = max(due_date, today)
-            assignment_due_date_counts_by_subject_and_stage[
-                a["data"]["subject_type"]
-            ][
-                a["data"]["srs_stage"]
-            ][
-                due_date
-            ] += 1
-
-        start_date = a["data"]["started_at"]
-        if start_date is not None:
-            start_date -= datetime.timedelta(hours=start_date.hour,
-                                             minutes=start_date.minute,
-                                             seconds=start_date.second,
-                                             microseconds=start_date.microsecond)
-            assingment_started_per_week[
-                a["data"]["subject_type"]
-            ][
-                start_date.isocalendar()[:2]
-            ] += 1
-            all_weeks.add(start_date.isocalendar()[:2])
-
-        burn_date = a["data"]["burned_at"]
-        if burn_date is not None:
-            burn_date -= datetime.timedelta(hours=burn_date.hour,
-                                            minutes=burn_date.minute,
-                                            seconds=burn_date.second,
-                                            microseconds=burn_date.microsecond)
-            assingments_burned_per_week[
-                a["data"]["subject_type"]
-            ][
-                burn_date.isocalendar()[:2]
-            ] += 1
-            all_weeks.add(burn_date.isocalendar()[:2])
-
-    fig = plt.figure(figsize=(17, 12), num=4)
-    for j, t in enumerate(object_types):
-        for i in range(1, 6):
-
-            if i == 1:
-                data = assignment_due_date_counts_by_subject_and_stage[t][i].copy()
-                for k, v in assignment_due_date_counts_by_subject_and_stage[t][i + 1].items():
-                    data[k] += v
-                for k, v in assignment_due_date_counts_by_subject_and_stage[t][i + 2].items():
-                    data[k] += v
-                for k, v in assignment_due_date_counts_by_subject_and_stage[t][i + 3].items():
-                    data[k] += v
-            if i == 2:
-                data = assignment_due_date_counts_by_subject_and_stage[t][5].copy()
-            if i == 3:
-                data = assignment_due_date_counts_by_subject_and_stage[t][6].copy()
-            if i == 4:
-                data = assignment_due_date_counts_by_subject_and_stage[t][7].copy()
-            if i == 5:
-                data = assignment_due_date_counts_by_subject_and_stage[t][8].copy()
-
-            if len(data) == 0:
-                continue
-            ax = plt.subplot2grid((3, 5), (j, i - 1))
-            calendar_heatmap(ax,
-                             data.keys(),
-                             [x for x in data.values()]
-                             )
-    fig.show()
-
-    fig = plt.figure(figsize=(17, 12), num=7)
-    for j, t in enumerate(object_types):
-        ax = fig.add_subplot(311 + j)
-        ax.set_title(t.capitalize())
-        total_started = 0
-        total_burned = 0
-        balance = 0
-        weeks = []
-        started_list = []
-        burned_list = []
-        balance_list = []
-        for year_and_week in sorted(all_weeks):
-            started = assingment_started_per_week[t][year_and_week]
-            burned = assingments_burned_per_week[t][year_and_week]
-            total_started += started
-            total_burned += burned
-            balance += started - burned
-            weeks.append(datetime.datetime(int(year_and_week[0]), 1, 1) + datetime.timedelta(weeks=int(year_and_week[1]) - 1))
-            started_list.append(total_started)
-            burned_list.append(total_burned)
-            balance_list.append(balance)
-        legend = ["started", "burned", "balance"]
-        ax.plot(weeks, started_list, color="blue")
-        ax.plot(weeks, burned_list, color="red")
-        ax.plot(weeks, balance_list, color="green")
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
-        ax.grid(True)
-        ax.legend(legend, loc="upper left")
-    fig.show()
-    # plt.waitforbuttonpress()
-
-    with open("last_done.txt", "w") as l:
+            render_figures(figure_inputs, out_dir, formats, workers)
+
+    with open(os.path.join(directory, LAST_DONE_FILE), "w") as l:
         l.write(datetime.datetime.utcnow().isoformat())
 
 
 if __name__ == '__main__':
-    main()
+    import argparse
+
+    import profiling
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", metavar="OUT_DIR",
+                        help="render the figures with the Agg backend into OUT_DIR instead of showing them")
+    parser.add_argument("--format", nargs="+", default=["png"], choices=["png", "svg"])
+    parser.add_argument("--workers", type=int, help="number of rendering processes, defaults to the CPU count")
+    parser.add_argument("--profile", choices=["table", "json"], default=os.environ.get("WK_PROFILE") or None,
+                        help="report the time and peak memory of every stage, defaults to $WK_PROFILE")
+    parser.add_argument("--profile-output", default=os.environ.get("WK_PROFILE_OUTPUT"),
+                        help="write the report to this file instead of stderr, also turns the report on, "
+                             "defaults to $WK_PROFILE_OUTPUT")
+    parser.add_argument("--cprofile", metavar="DIR", default=os.environ.get("WK_CPROFILE"),
+                        help="also save cProfile stats of every stage to DIR, defaults to $WK_CPROFILE")
+    parser.add_argument("--tokens", nargs="+", metavar="TOKEN_FILE",
+                        help="chart every account of these token files, each in its own directory of --accounts-dir")
+    parser.add_argument("--accounts-dir", default=ACCOUNTS_DIR,
+                        help="directory with the per account directories and the shared subject catalog")
+    parser.add_argument("--jobs", type=int, help="number of accounts fetched at the same time, defaults to all")
+    parser.add_argument("--top", type=int, default=20, help="number of subjects printed per ranking")
+    parser.add_argument("--stage-groups", nargs="+", metavar="NAME=STAGES",
+                        help="rank the time spent on these groups of stages, e.g. apprentice=1-4 guru=5,6, "
+                             "instead of one ranking per SRS level name")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat,
+                        help="only chart the reviews and stage counts from this date or hour on")
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat,
+                        help="only chart the reviews and stage counts before this date or hour")
+    args = parser.parse_args()
+    for name, value in [("since", args.since), ("until", args.until)]:
+        # The range index sums whole hours, a window cutting through one would not match the stage lines
+        if value is not None and value != value.replace(minute=0, second=0, microsecond=0):
+            parser.error(f"--{name} has to be a date or a time on the hour, like 2023-05-01T18:00")
+    try:
+        stage_groups = STAGE_GROUPS if args.stage_groups is None else parse_stage_groups(args.stage_groups)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.headless is not None or args.tokens is not None:
+        matplotlib.use("Agg")
+    # Any of the profiling options turns it on, the report defaults to a table
+    if args.profile is not None or args.profile_output is not None or args.cprofile is not None:
+        profiling.enable(args.cprofile)
+    if args.tokens is not None:
+        main_batch(args.tokens, args.headless, args.format, args.workers, args.jobs, args.accounts_dir, args.since,
+                   args.until, args.top, stage_groups)
+    else:
+        main(args.headless, args.format, args.workers, args.since, args.until, args.top, stage_groups)
+    profiling.report(args.profile or "table", args.profile_output)
@@ -1,66 +1,265 @@
-from collections import defaultdict
-from pathlib import Path
+import os
+import random
+import signal
+import threading
 
+import numpy as np
 import urllib3
 import json
-from time import sleep
 from datetime import datetime
 
-temp = (Path(__file__) / ".." / "wanikani_token").resolve()
-with open(temp, "r") as t:
-    wanikani_token = t.read()
+from accounts import ACCOUNTS_DIR, account_dir, read_tokens
+from assignment_archive import ASSIGNMENT_DTYPE, LOG_FILE, PROJECTION_FILE, append_pages, import_json, \
+    load_projection, project, reproject, save_projection, stage_counts, upsert
+from fetcher import API_URL, RateLimiter, iter_pages, read_token, run_concurrently
+from review_aggregation import SUBJECT_TYPES
+from snapshot_store import append_snapshots
 
 
-def worker():
-    with open("out_ass.json", "r") as d:
-        assignments = json.load(d)
+def load_validators(path):
+    try:
+        with open(path, "r") as v:
+            return json.load(v)
+    except FileNotFoundError:
+        return {}
 
-    http = urllib3.PoolManager()
-    next_url = f"https://api.wanikani.com/v2/assignments?updated_after={assignments['data_updated_at']}"
 
-    temp_data = []
-    while next_url is not None:
-        t = http.request("GET",
-                         next_url,
-                         headers={"Authorization": f"Bearer {wanikani_token}"}
-                         )
-        data = json.loads(t.data.decode("utf-8"))
-        temp_data.extend(data["data"])
-        next_url = data["pages"]["next_url"]
-        if data["data_updated_at"]:
-            assignments['data_updated_at'] = data['data_updated_at']
-        print("Got one page. Next ", next_url)
-        if next_url is not None:
-            sleep(2)
+def conditional_headers(validators, endpoint, url):
+    headers = dict()
+    stored = validators.get(endpoint)
+    if stored is None or stored["url"] != url:
+        return headers
+    if stored["etag"]:
+        headers["If-None-Match"] = stored["etag"]
+    if stored["last_modified"]:
+        headers["If-Modified-Since"] = stored["last_modified"]
+    return headers
 
-    assignments["data"].update({str(x["id"]): x for x in temp_data})
 
-    with open("out_ass.json", "w") as d:
-        json.dump(assignments, d)
+class Collector:
+    """
+    The assignments of one account, kept in memory between polls together with the connection pool.
+    They are archived as a log of the raw pages plus a projection of the columns that are used.
+    Polling only changes the in-memory state, nothing is written to disk until flush().
+    """
 
-    coll = defaultdict(lambda: defaultdict(int))
-    for k, a in assignments["data"].items():
-        d = a["data"]
-        t = d["subject_type"]
-        s = d["srs_stage"]
+    def __init__(self, token,
+                 api_url=API_URL,
+                 log_file=LOG_FILE,
+                 projection_file=PROJECTION_FILE,
+                 validators_file="out_ass_etags.json",
+                 store="wanikani_perf.snapshots",
+                 assignments_file="out_ass.json",
+                 http=None,
+                 limiter=None):
+        self.token = token
+        self.api_url = api_url
+        self.log_file = log_file
+        self.projection_file = projection_file
+        self.validators_file = validators_file
+        self.store = store
+        self.http = urllib3.PoolManager() if http is None else http
+        self.limiter = RateLimiter() if limiter is None else limiter
 
-        coll[t][s] += 1
+        loaded = load_projection(projection_file)
+        if loaded is None and os.path.exists(log_file):
+            # A log without a projection, lost or only an imported history, is replayed
+            loaded = reproject(log_file)
+            save_projection(projection_file, *loaded)
+        elif loaded is None and os.path.exists(assignments_file):
+            # The first run imports the assignments collected before the archive existed
+            loaded = import_json(assignments_file, log_file, projection_file)
+        if loaded is None:
+            loaded = np.zeros(0, dtype=ASSIGNMENT_DTYPE), None
+        self.assignments, self.data_updated_at = loaded
+        self.validators = load_validators(validators_file)
+        self.pages = []
+        self.snapshots = []
 
-    return coll
+    def poll(self):
+        """
+        Fetches the assignments changed since the last poll and takes a snapshot of the counts.
+        Returns the (subject type x srs stage) counts.
+        """
+        now = datetime.now()
+        url = f"{self.api_url}/assignments"
+        if self.data_updated_at is not None:
+            url += f"?updated_after={self.data_updated_at}"
+        headers = conditional_headers(self.validators, "assignments", url)
 
+        validators = None
+        data_updated_at = self.data_updated_at
+        pages = []
+        for page_number, (t, data) in enumerate(iter_pages(self.http, self.limiter, self.token, url, headers)):
+            if data is None:
+                print("Not modified since last run")
+                break
+            if page_number == 0:
+                validators = {
+                    "url": url,
+                    "etag": t.headers.get("ETag"),
+                    "last_modified": t.headers.get("Last-Modified"),
+                }
+            pages.append(data)
+            if data["data_updated_at"]:
+                data_updated_at = data["data_updated_at"]
+            print("Got one page. Next ", data["pages"]["next_url"])
 
-def collect_data():
-    now = datetime.now()
-    with open("wanikani_perf.json", "r") as f:
-        data = json.load(f)
+        # Only a poll that fetched every page changes the state, so a failed one is simply repeated
+        changed = [x for page in pages for x in page["data"]]
+        if changed:
+            self.assignments = upsert(self.assignments, project(changed))
+            self.pages.append((now.isoformat(), [page for page in pages if page["data"]]))
+        self.data_updated_at = data_updated_at
+        if validators is not None:
+            self.validators["assignments"] = validators
 
-    n = worker()
+        counts = stage_counts(self.assignments)
+        self.snapshots.append((now, counts))
+        return counts
 
-    data[str(now)] = n
+    def flush(self):
+        # The raw pages go first, a projection that is behind the log is simply caught up on the next poll
+        if self.pages:
+            for fetched_at, pages in self.pages:
+                append_pages(self.log_file, pages, fetched_at)
+            self.pages = []
+            save_projection(self.projection_file, self.assignments, self.data_updated_at)
 
-    with open("wanikani_perf.json", "w") as f:
-        json.dump(data, f)
+        with open(self.validators_file, "w") as v:
+            json.dump(self.validators, v)
+
+        if self.snapshots:
+            append_snapshots(self.store, *zip(*self.snapshots))
+            self.snapshots = []
+
+
+class CollectorGroup:
+    """
+    The collectors of several accounts, polled at the same time over one connection pool.
+    Every account keeps its own rate limiter and files, so it can be used wherever a single Collector is.
+    """
+
+    def __init__(self, collectors, jobs=None):
+        self.collectors = collectors
+        self.jobs = jobs
+
+    def poll(self):
+        # Every account is polled even when another one fails, the first failure is raised afterwards
+        return run_concurrently({name: c.poll for name, c in self.collectors.items()}, self.jobs)
+
+    def flush(self):
+        for collector in self.collectors.values():
+            collector.flush()
+
+
+def account_collectors(token_files, root=ACCOUNTS_DIR, jobs=None):
+    """
+    A CollectorGroup of the accounts of token_files, with the files of each in its own directory of root.
+    """
+    tokens = read_tokens(token_files)
+    http = urllib3.PoolManager(maxsize=jobs or len(tokens))
+    collectors = dict()
+    for name, token in tokens.items():
+        directory = account_dir(name, root)
+        collectors[name] = Collector(token,
+                                     log_file=os.path.join(directory, LOG_FILE),
+                                     projection_file=os.path.join(directory, PROJECTION_FILE),
+                                     validators_file=os.path.join(directory, "out_ass_etags.json"),
+                                     store=os.path.join(directory, "wanikani_perf.snapshots"),
+                                     assignments_file=os.path.join(directory, "out_ass.json"),
+                                     http=http)
+    return CollectorGroup(collectors, jobs)
+
+
+def check_projection(log_file=LOG_FILE, projection_file=PROJECTION_FILE):
+    loaded = load_projection(projection_file)
+    if loaded is None:
+        print(f"{projection_file} does not exist")
+        return False
+
+    rebuilt, _ = reproject(log_file)
+    # Compared as bytes, since NaT never equals NaT
+    if loaded[0].dtype == rebuilt.dtype and loaded[0].tobytes() == rebuilt.tobytes():
+        return True
+    stored, rebuilt = stage_counts(loaded[0]), stage_counts(rebuilt)
+    print(f"{projection_file} differs from the raw log")
+    for t, s in zip(*np.nonzero(stored != rebuilt)):
+        print(f"{SUBJECT_TYPES[t]} stage {s}: stored {stored[t, s]}, rebuilt {rebuilt[t, s]}")
+    return False
+
+
+def collect_data(store="wanikani_perf.snapshots"):
+    collector = Collector(read_token(), store=store)
+    collector.poll()
+    collector.flush()
+
+
+def run_daemon(collector, interval=3600.0, jitter=0.1, retry=60.0, max_backoff=3600.0, flush_every=24, stop=None):
+    """
+    Polls every interval seconds, give or take jitter (a fraction of it), until SIGTERM or SIGINT.
+    A failed poll is retried after retry seconds, doubling with every further failure up to max_backoff.
+    Snapshots and the assignment state are flushed to disk every flush_every polls and when stopping.
+    """
+    if stop is None:
+        stop = threading.Event()
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, lambda *args: stop.set())
+
+    failures = 0
+    polls = 0
+    try:
+        while not stop.is_set():
+            try:
+                collector.poll()
+            except (urllib3.exceptions.HTTPError, ValueError, KeyError) as e:
+                failures += 1
+                delay = min(retry * 2 ** (failures - 1), max_backoff)
+                print(f"Poll failed ({e}), retrying in {delay:g}s")
+            else:
+                failures = 0
+                polls += 1
+                if polls % flush_every == 0:
+                    collector.flush()
+                delay = interval * random.uniform(1 - jitter, 1 + jitter)
+            stop.wait(delay)
+    finally:
+        collector.flush()
 
 
 if __name__ == '__main__':
-    collect_data()
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", action="store_true",
+                        help="rebuild the assignment projection from the raw page log and compare with the stored one")
+    parser.add_argument("--daemon", action="store_true", help="keep running and poll on a schedule instead of once")
+    parser.add_argument("--interval", type=float, default=3600.0, help="seconds between polls in daemon mode")
+    parser.add_argument("--jitter", type=float, default=0.1, help="random fraction of the interval added or removed")
+    parser.add_argument("--retry", type=float, default=60.0,
+                        help="seconds before retrying a failed poll, doubled with every further failure")
+    parser.add_argument("--max-backoff", type=float, default=3600.0, help="longest wait between failed polls")
+    parser.add_argument("--flush-every", type=int, default=24,
+                        help="number of polls after which the snapshots and state are written to disk")
+    parser.add_argument("--tokens", nargs="+", metavar="TOKEN_FILE",
+                        help="collect every account of these token files, each in its own directory of --accounts-dir")
+    parser.add_argument("--accounts-dir", default=ACCOUNTS_DIR)
+    parser.add_argument("--jobs", type=int, help="number of accounts polled at the same time, defaults to all")
+    args = parser.parse_args()
+    if args.check:
+        if args.tokens is None:
+            sys.exit(0 if check_projection() else 1)
+        directories = [account_dir(name, args.accounts_dir) for name in read_tokens(args.tokens)]
+        checked = [check_projection(os.path.join(d, LOG_FILE), os.path.join(d, PROJECTION_FILE)) for d in directories]
+        sys.exit(0 if all(checked) else 1)
+    if args.tokens is None and not args.daemon:
+        collect_data()
+    else:
+        collector = Collector(read_token()) if args.tokens is None else \
+            account_collectors(args.tokens, args.accounts_dir, args.jobs)
+        if args.daemon:
+            run_daemon(collector, args.interval, args.jitter, args.retry, args.max_backoff, args.flush_every)
+        else:
+            collector.poll()
+            collector.flush()
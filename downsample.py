@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def figure_pixels(fig):
+    # The width of the whole figure in pixels, an upper bound for any of its axes
+    return int(np.ceil(fig.get_figwidth() * fig.dpi))
+
+
+def downsample(x, y, buckets):
+    """
+    The points of a line that are needed to draw it buckets (e.g. pixels) wide without changing its shape:
+    the first, last, lowest and highest point of every bucket of x.
+    Lines with fewer than 4 points per bucket are returned as they are.
+    x has to be sorted within runs; where it goes back, e.g. when a second series is appended,
+    every run is downsampled on its own so the line is still drawn in the same order.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) <= 4 * buckets:
+        return x, y
+
+    position = x.astype("M8[us]").astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x
+    position = position.astype(np.float64)
+    low, high = position.min(), position.max()
+    bucket = np.minimum(((position - low) / max(high - low, 1) * buckets).astype(np.int64), buckets - 1)
+
+    # Separate runs never share a bucket
+    run = np.zeros(len(x), dtype=np.int64)
+    run[1:] = np.cumsum(position[1:] < position[:-1])
+    bucket += run * buckets
+
+    # Sorting by (bucket, y) puts the lowest point of every bucket first and the highest last
+    by_value = np.lexsort((y, bucket))
+    value_edges = np.flatnonzero(np.diff(bucket[by_value])) + 1
+    edges = np.flatnonzero(np.diff(bucket)) + 1
+    keep = np.concatenate([
+        by_value[np.concatenate([[0], value_edges])],
+        by_value[np.concatenate([value_edges - 1, [len(x) - 1]])],
+        [0], edges, edges - 1, [len(x) - 1],
+    ])
+    keep = np.unique(keep)
+    return x[keep], y[keep]
@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import urllib3
+
+API_URL = "https://api.wanikani.com/v2"
+TOKEN_FILE = (Path(__file__) / ".." / "wanikani_token").resolve()
+
+
+def read_token(path=TOKEN_FILE):
+    with open(path, "r") as t:
+        return t.read()
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every request made with one API token.
+    Starts from the documented 60 requests per minute and follows the RateLimit-* response headers after that.
+    """
+
+    def __init__(self, requests=60, period=60.0):
+        self.capacity = requests
+        self.rate = requests / period
+        self.tokens = float(requests)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def update(self, headers, exhausted=False):
+        remaining = 0 if exhausted else headers.get("RateLimit-Remaining")
+        if remaining is None:
+            return
+        reset = headers.get("RateLimit-Reset")
+        with self.lock:
+            self.tokens = min(self.tokens, float(remaining))
+            if self.tokens < 1 and reset is not None:
+                self.blocked_until = time.monotonic() + max(0.0, float(reset) - time.time())
+
+
+def request(http, limiter, token, url, headers=None):
+    while True:
+        limiter.acquire()
+        response = http.request("GET", url, headers={"Authorization": f"Bearer {token}", **(headers or {})})
+        limiter.update(response.headers, exhausted=response.status == 429)
+        if response.status != 429:
+            return response
+
+
+def iter_pages(http, limiter, token, url, headers=None):
+    """
+    Yields (response, page) for every page of a collection, following next_url.
+    The extra headers are only sent with the first request, so they can be used for conditional requests.
+    On a 304 the page is None and iteration stops.
+    """
+    while url is not None:
+        response = request(http, limiter, token, url, headers)
+        headers = None
+        if response.status == 304:
+            yield response, None
+            return
+        if response.status >= 400:
+            raise urllib3.exceptions.HTTPError(f"{url} returned HTTP {response.status}")
+        page = json.loads(response.data.decode("utf-8"))
+        yield response, page
+        url = page["pages"]["next_url"]
+
+
+def fetch_collection(http, limiter, token, url):
+    items = []
+    for response, page in iter_pages(http, limiter, token, url):
+        items.extend(page["data"])
+    return items
+
+
+def fetch_all(token, urls, http=None, limiter=None):
+    """
+    Fetches every collection in urls ({name: url}) at the same time over one connection pool and rate limiter.
+    Returns {name: [items]}.
+    """
+    if http is None:
+        http = urllib3.PoolManager(maxsize=len(urls))
+    if limiter is None:
+        limiter = RateLimiter()
+    return run_concurrently({name: (lambda u=url: fetch_collection(http, limiter, token, u))
+                             for name, url in urls.items()})
+
+
+def run_concurrently(jobs, max_workers=None):
+    # Runs every job ({name: callable}) in its own thread, or max_workers at a time, and returns {name: result}
+    with ThreadPoolExecutor(max_workers=max_workers or max(len(jobs), 1)) as executor:
+        futures = {name: executor.submit(job) for name, job in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
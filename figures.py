@@ -0,0 +1,360 @@
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.dates as mdates
+import numpy as np
+from matplotlib import rcParams
+from matplotlib.collections import PathCollection
+from matplotlib.figure import Figure
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
+
+from downsample import downsample, figure_pixels
+from review_aggregation import ANSWER_KINDS, SUBJECT_TYPES
+from time_buckets import iso_year_week, week_start
+
+colors = [
+    "black",
+    "xkcd:dark red",
+    "red",
+    "orange",
+    "xkcd:pink",
+    "xkcd:lime",
+    "green",
+    "xkcd:dark green",
+    "xkcd:cyan",
+    "xkcd:blue",
+    "xkcd:dark blue",
+]
+
+
+
+def calendar_array(dates, data):
+    dates = np.asarray(dates, dtype="M8[D]")
+    weeks = week_start(dates)
+    i = (weeks - weeks.min()).astype(np.int64) // 7
+    j = (dates - weeks).astype(np.int64)
+    ni = i.max() + 1
+
+    calendar = np.nan * np.zeros((ni, 7))
+    calendar[i, j] = data
+    return i, j, calendar
+
+
+def calendar_heatmap(ax, dates, data):
+    dates = np.asarray(dates, dtype="M8[D]")
+    i, j, calendar = calendar_array(dates, data)
+    im = ax.imshow(calendar, interpolation='none', cmap='summer')
+    label_days(ax, data, i, j, calendar)
+    label_months(ax, dates, i, j, calendar)
+    ax.figure.colorbar(im)
+
+
+_label_paths = dict()
+
+
+def _label_path(text, size):
+    # Centered outline of the label in points, shared by every cell showing the same number
+    if (text, size) not in _label_paths:
+        path = TextPath((0, 0), text, size=size)
+        extents = path.get_extents()
+        _label_paths[(text, size)] = path.transformed(
+            Affine2D().translate(-(extents.x0 + extents.x1) / 2, -(extents.y0 + extents.y1) / 2))
+    return _label_paths[(text, size)]
+
+
+def label_days(ax, dates, i, j, calendar):
+    ni, nj = calendar.shape
+    day_of_month = np.nan * np.zeros((ni, 7))
+    day_of_month[i, j] = dates
+
+    # All labels are drawn by a single collection instead of one Text artist per cell
+    rows, columns = np.nonzero(np.isfinite(day_of_month))
+    size = rcParams["font.size"]
+    labels = PathCollection([_label_path(str(int(day)), size) for day in day_of_month[rows, columns]],
+                            offsets=np.column_stack([columns, rows]),
+                            offset_transform=ax.transData,
+                            transform=Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans,
+                            facecolors="black",
+                            edgecolors="none")
+    ax.add_collection(labels, autolim=False)
+
+    ax.set(xticks=np.arange(7),
+           xticklabels=['M', 'T', 'W', 'T', 'F', 'S', 'S'])
+    ax.xaxis.tick_top()
+
+
+def label_months(ax, dates, i, j, calendar):
+    month_labels = np.array(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul',
+                             'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
+    months = dates.astype("M8[M]").astype(np.int64) % 12 + 1
+    uniq_months = np.unique(months)
+    yticks = [i[months == m].mean() for m in uniq_months]
+    labels = month_labels[uniq_months - 1]
+    ax.set(yticks=yticks)
+    ax.set_yticklabels(labels, rotation=90)
+
+
+def accuracy_bars(fig, inputs):
+    for i, t in enumerate(SUBJECT_TYPES):
+        ax = fig.add_subplot(311 + i)
+        ax.set_title(t.capitalize())
+        labels = []
+        xticks = []
+        place = 0
+        coloring = {
+            "meaning_answers": "orange",
+            "reading_answers": "blue"
+        }
+        for w in np.flatnonzero(inputs["weekly_count"][:, i]):
+            year, week = inputs["weeks_year"][w], inputs["weeks_number"][w]
+            weekly_data = dict(zip(ANSWER_KINDS, inputs["weekly_answers"][w, i].tolist()))
+            for m in ["reading_answers", "meaning_answers"]:
+                if t == "radical" and m == "reading_answers":
+                    continue
+                place += 1
+                if weekly_data[m] == 0:
+                    continue
+                ax.bar(place, 1 - weekly_data[f"incorrect_{m}"] / weekly_data[m], color=coloring[m], width=1)
+                ax.annotate(f'{weekly_data[m] - weekly_data[f"incorrect_{m}"]}\n/\n{weekly_data[m]}',
+                            (place, 0.5),
+                            (place, 0.5),
+                            horizontalalignment="center",
+                            color="black" if m == "meaning_answers" else "white")
+            xticks.append(place if t == "radical" else place - 0.5)
+            labels.append(f"{year}\nw{week}")
+            place += 0.5
+        ax.set_xticks(xticks)
+        ax.set_xticklabels(labels)
+
+        ax.set_yticks([x / 10 for x in range(0, 11)])
+        ax.set_yticklabels([f"{x * 10}%" for x in range(0, 11)])
+
+        ax.yaxis.grid(True)
+        if t == "radical":
+            ax.legend(["meaning"], loc="lower left")
+        else:
+            ax.legend(["meaning", "reading"], loc="lower left")
+
+
+def level_change(fig, daily_level_change):
+    for i, t in enumerate(SUBJECT_TYPES):
+        ax = fig.add_subplot(311 + i)
+        ax.set_title(t.capitalize())
+        ax.plot(*daily_level_change[t])
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
+
+
+def moving_average(fig, daily_level_change, window_width=7):
+    for i, t in enumerate(SUBJECT_TYPES):
+        ax = fig.add_subplot(311 + i)
+        ax.set_title(t.capitalize())
+        days, level_change = daily_level_change[t]
+        cum_sum = np.cumsum(np.insert(level_change, 0, 0))
+        ma_vec = (cum_sum[window_width:] - cum_sum[:-window_width]) / window_width
+        ax.plot(days[window_width // 2:-((window_width - 1) // 2)], ma_vec)
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
+
+
+def stage_lines(fig, inputs):
+    for i, t in enumerate(SUBJECT_TYPES):
+        has_data = [False for x in range(10)]
+        ax = fig.add_subplot(311 + i)
+        ax.set_title(t.capitalize())
+        labels = []
+        maximum = 0
+        times, totals = inputs["accumulated"][t]
+        for x in range(1, 10):
+            reached = np.flatnonzero(totals[:, x])
+            if len(reached) == 0:
+                continue
+            # Only the last of the leading zeros is drawn
+            first = max(reached[0] - 1, 0)
+            f = times[first:]
+            s = totals[first:, x]
+            maximum = max(maximum, s.max())
+            has_data[x] = True
+            ax.plot(*downsample(f, s, figure_pixels(fig)), color=colors[x])
+            labels.append(str(x))
+        ax.legend(labels, loc="upper left", ncol=3 if has_data[9] else 4)
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
+        ax.vlines(inputs["level_ups"], 0, maximum, linestyles="dashed", zorder=-1)
+        print(maximum)
+
+
+def weekly_stage_accuracy(fig, inputs):
+    for i, t in enumerate(SUBJECT_TYPES):
+        ax = fig.add_subplot(311 + i)
+        ax.set_title(t.capitalize())
+        place = 0
+        legend = [_ for _ in range(1, 9)]
+        labels = []
+        for w in np.flatnonzero(inputs["weekly_correct"][:, i].any(axis=1)):
+            labels.append(f"{inputs['weeks_year'][w]}\nw{inputs['weeks_number'][w]}")
+            place += 2
+            correct = [0 for x in range(10)]
+            total = [0 for x in range(10)]
+            v = inputs["weekly_correct"][w, i]
+            for x in range(1, 10):
+                correct[x] += v[x]
+                total[x] += v[x] + inputs["weekly_wrong"][w, i, x]
+
+                if total[x] > 0:
+                    legend[x - 1] = ax.bar(place, correct[x] / total[x], color=colors[x], width=1)
+                place += 1
+
+        ax.legend(legend, [x for x in range(1, 9)], ncol=9, loc="lower center")
+        ax.set_xticks([x * 11 + 5.5 for x in range(len(labels))])
+        ax.set_xticklabels(labels)
+        ax.set_yticks([x / 10 for x in range(0, 11)])
+        ax.set_yticklabels([f"{x * 10}%" for x in range(0, 11)])
+        ax.yaxis.grid(True)
+        ax.set_ybound(0, 1.05)
+
+
+def due_calendars(fig, due_dates):
+    for j, t in enumerate(SUBJECT_TYPES):
+        for i, panel in enumerate(due_dates[t]):
+            dates, counts = panel
+            if len(dates) == 0:
+                continue
+            ax = fig.add_subplot(3, 5, j * 5 + i + 1)
+            calendar_heatmap(ax, dates, counts)
+
+
+def started_burned(fig, weekly_totals):
+    for j, t in enumerate(SUBJECT_TYPES):
+        ax = fig.add_subplot(311 + j)
+        ax.set_title(t.capitalize())
+        weeks, started_list, burned_list, balance_list = weekly_totals[t]
+        legend = ["started", "burned", "balance"]
+        ax.plot(weeks, started_list, color="blue")
+        ax.plot(weeks, burned_list, color="red")
+        ax.plot(weeks, balance_list, color="green")
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
+        ax.grid(True)
+        ax.legend(legend, loc="upper left")
+
+
+def review_figure_inputs(aggregates, accumulated, level_ups, recent=None):
+    """
+    Inputs of the figures drawn from the reviews, aggregates as returned by aggregate_reviews.
+    accumulated is {subject type: (times, stage totals)} and level_ups the dates of the level ups.
+    recent are the aggregates of the weeks shown by the weekly stage accuracy, all of aggregates by default.
+    """
+    weeks_year, weeks_number = iso_year_week(aggregates["weeks"])
+    if recent is None:
+        recent = aggregates
+    recent_year, recent_number = iso_year_week(recent["weeks"])
+
+    daily_level_change = dict()
+    for i, t in enumerate(SUBJECT_TYPES):
+        reviewed = aggregates["daily_count"][:, i] > 0
+        daily_level_change[t] = (aggregates["days"][reviewed],
+                                 aggregates["daily_level_change"][reviewed, i] / aggregates["daily_count"][reviewed, i])
+
+    return {
+        "accuracy_bars": {
+            "weeks_year": weeks_year,
+            "weeks_number": weeks_number,
+            "weekly_count": aggregates["weekly_count"],
+            "weekly_answers": aggregates["weekly_answers"],
+        },
+        "level_change": daily_level_change,
+        "moving_average": daily_level_change,
+        "stage_lines": {
+            "accumulated": accumulated,
+            "level_ups": level_ups,
+        },
+        "weekly_stage_accuracy": {
+            "weeks_year": recent_year,
+            "weeks_number": recent_number,
+            "weekly_correct": recent["weekly_correct"],
+            "weekly_wrong": recent["weekly_wrong"],
+        },
+    }
+
+
+def review_forecast(fig, forecast):
+    ax = fig.add_subplot(111)
+    ax.set_title("Review forecast")
+    days = forecast["days"]
+    ax.stackplot(days, forecast["mean"], colors=["xkcd:cyan", "xkcd:pink", "xkcd:purple"],
+                 labels=[f"{t.capitalize()} (mean)" for t in SUBJECT_TYPES])
+    low, median, high = (forecast["percentiles"][p] for p in sorted(forecast["percentiles"]))
+    ax.fill_between(days, low, high, color="black", alpha=0.15, label="total, 10th to 90th percentile")
+    ax.plot(days, median, color="black", label="total, median")
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y\n%m-%d'))
+    ax.grid(True)
+    ax.legend(loc="upper right")
+
+
+# name: (draw function, figure number, figure size)
+FIGURES = {
+    "accuracy_bars": (accuracy_bars, 0, (15, 13)),
+    "level_change": (level_change, 5, (10, 13)),
+    "moving_average": (moving_average, 6, (10, 13)),
+    "stage_lines": (stage_lines, 1, (10, 13)),
+    "weekly_stage_accuracy": (weekly_stage_accuracy, 2, (12, 13)),
+    "due_calendars": (due_calendars, 4, (17, 12)),
+    "started_burned": (started_burned, 7, (17, 12)),
+    "review_forecast": (review_forecast, 8, (15, 8)),
+}
+
+
+def show_figures(figure_inputs):
+    import matplotlib.pyplot as plt
+
+    for name, inputs in figure_inputs.items():
+        draw, num, figsize = FIGURES[name]
+        fig = plt.figure(num=num, figsize=figsize)
+        draw(fig, inputs)
+        fig.show()
+
+
+def render_figure(name, inputs, out_dir, formats):
+    # A bare Figure is drawn with the Agg canvas when saved, so no display or pyplot state is needed
+    draw, num, figsize = FIGURES[name]
+    fig = Figure(figsize=figsize)
+    draw(fig, inputs)
+    paths = []
+    for f in formats:
+        paths.append(os.path.join(out_dir, f"{name}.{f}"))
+        fig.savefig(paths[-1])
+    return paths
+
+
+def render_figures(figure_inputs, out_dir, formats=("png",), workers=None):
+    """
+    Renders every figure to out_dir in a process pool.
+    A figure is skipped when its inputs are the same as on the previous render and its files still exist.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    hashes_file = os.path.join(out_dir, "render_hashes.json")
+    try:
+        with open(hashes_file) as h:
+            previous = json.load(h)
+    except FileNotFoundError:
+        previous = dict()
+
+    hashes = dict()
+    pending = dict()
+    for name, inputs in figure_inputs.items():
+        hashes[name] = hashlib.sha256(pickle.dumps((inputs, sorted(formats)))).hexdigest()
+        unchanged = previous.get(name) == hashes[name]
+        if unchanged and all(os.path.exists(os.path.join(out_dir, f"{name}.{f}")) for f in formats):
+            print(f"{name} unchanged, skipping")
+            continue
+        pending[name] = inputs
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {name: executor.submit(render_figure, name, inputs, out_dir, formats)
+                   for name, inputs in pending.items()}
+        for name, future in futures.items():
+            print(f"wrote {', '.join(future.result())}")
+
+    with open(hashes_file, "w") as h:
+        json.dump(hashes, h)
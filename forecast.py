@@ -0,0 +1,117 @@
+import numpy as np
+
+from assignment_archive import COUNT_ROWS
+from review_aggregation import SUBJECT_TYPES
+
+# Hours until the next review after reaching stage 1 to 8
+SRS_INTERVALS = [4, 8, 23, 47, 167, 335, 719, 2879]
+
+# Hours until the next review indexed by stage, stage 9 (burned) is never reviewed again
+_NEXT_REVIEW = np.array([0] + SRS_INTERVALS + [np.inf], dtype=np.float32)
+
+# Runs simulated together, enough to keep the loop vectorized while the per review arrays stay small
+RUN_CHUNK = 100
+
+
+def next_stage(stage, correct):
+    # A wrong answer drops one stage, or two from guru and above, but never below stage 1
+    return np.where(correct, stage + 1, np.maximum(stage - np.where(stage >= 5, 2, 1), 1)).astype(stage.dtype)
+
+
+def pass_rates(weekly_correct, weekly_wrong, weeks=None, default=0.85):
+    """
+    The chance of answering a review of each (subject type, starting stage) correctly, from the weekly
+    aggregates of aggregate_reviews, over only the last weeks when given. Pairs without reviews get default.
+    """
+    if weeks is not None:
+        weekly_correct = weekly_correct[-weeks:]
+        weekly_wrong = weekly_wrong[-weeks:]
+    correct = weekly_correct.sum(axis=0)
+    total = correct + weekly_wrong.sum(axis=0)
+    rates = np.full(correct.shape, default)
+    np.divide(correct, total, out=rates, where=total > 0)
+    return rates
+
+
+def forecast_reviews(assignments, rates, now, days=180, runs=1000, seed=None):
+    """
+    Monte Carlo forecast of the reviews due on each of the next days, starting with the day of now.
+    assignments is an assignment_archive projection.
+    Every started, unburned assignment is reviewed when it becomes available (overdue ones today), passes with
+    the rate of its type and stage and moves on by the SRS intervals. RUN_CHUNK runs are simulated at once, one
+    review per assignment at a time, so the loop only runs as often as the most reviewed assignment is reviewed
+    and the memory stays bounded by the chunk instead of all runs.
+    Returns a (runs x subject types x days) array of review counts.
+    """
+    rng = np.random.default_rng(seed)
+    stages = assignments["srs_stage"]
+    types = COUNT_ROWS[assignments["subject_type"]]
+    available = assignments["available_at"]
+    active = (stages >= 1) & (stages <= 8) & ~np.isnat(available)
+
+    start = np.datetime64(now, "D").astype("M8[us]")
+    horizon = np.float32(days * 24)
+    hours = ((available[active] - start) / np.timedelta64(1, "h")).astype(np.float32)
+
+    n = int(active.sum())
+    first_due = np.maximum(hours, (np.datetime64(now, "us") - start) / np.timedelta64(1, "h")).astype(np.float32)
+    active_stages = stages[active]
+    active_types = types[active]
+    rates = np.asarray(rates, dtype=np.float32)
+
+    counts = np.zeros((runs, len(SUBJECT_TYPES), days), dtype=np.int64)
+    for first in range(0, runs, RUN_CHUNK):
+        chunk = min(RUN_CHUNK, runs - first)
+        stage = np.tile(active_stages, chunk)
+        due = np.tile(first_due, chunk)
+        chunk_counts = np.zeros(chunk * len(SUBJECT_TYPES) * days, dtype=np.int64)
+        pending = np.flatnonzero(due < horizon)
+        while len(pending):
+            at = due[pending]
+            pending_types = active_types[pending % n]
+            # The flat (run, subject type, day) of every review, to count them with one bincount
+            group = (pending // n * len(SUBJECT_TYPES) + pending_types) * days + (at // 24).astype(np.int64)
+            chunk_counts += np.bincount(group, minlength=len(chunk_counts))
+            current = stage[pending]
+            correct = rng.random(len(pending), dtype=np.float32) < rates[pending_types, current]
+            current = next_stage(current, correct)
+            stage[pending] = current
+            due[pending] = at + _NEXT_REVIEW[current]
+            pending = pending[due[pending] < horizon]
+        counts[first:first + chunk] = chunk_counts.reshape(chunk, len(SUBJECT_TYPES), days)
+    return counts
+
+
+def summarize(counts, now, percentiles=(10, 50, 90)):
+    # The days of a forecast_reviews result with the mean reviews per subject type and percentiles of the total
+    totals = counts.sum(axis=1)
+    return {
+        "days": np.datetime64(now, "D") + np.arange(counts.shape[-1]),
+        "mean": counts.mean(axis=0),
+        "percentiles": {p: np.percentile(totals, p, axis=0) for p in percentiles},
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    import synthetic
+    from assignment_archive import project
+
+    parser = argparse.ArgumentParser(description="Times the forecast on a synthetic account")
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--level-days", type=float, default=10, help="faster levels leave more assignments in progress")
+    args = parser.parse_args()
+
+    data = synthetic.generate(args.years, level_days=args.level_days)
+    start = time.perf_counter()
+    counts = forecast_reviews(project(data["assignments"]), np.full((len(SUBJECT_TYPES), 10), 0.85), data["end"],
+                              args.days, args.runs, seed=0)
+    elapsed = time.perf_counter() - start
+    active = sum(1 <= a["data"]["srs_stage"] <= 8 for a in data["assignments"])
+    summary = summarize(counts, data["end"])
+    print(f"{active} assignments x {args.runs} runs x {args.days} days in {elapsed:.2f}s")
+    print(f"first week median: {summary['percentiles'][50][:7].tolist()}")
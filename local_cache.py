@@ -0,0 +1,148 @@
+import datetime
+import json
+import sqlite3
+
+import numpy as np
+
+from review_aggregation import REVIEW_DTYPE, subject_type_code
+
+CACHE_FILE = "wanikani_cache.sqlite"
+
+DATE_FIELDS = {"data_updated_at", "created_at", "unlocked_at", "started_at", "passed_at", "burned_at",
+               "available_at", "resurrected_at", "completed_at", "abandoned_at", "hidden_at"}
+
+SUBJECT_OBJECTS = ["radical", "kanji", "vocabulary", "kana_vocabulary"]
+
+
+def connect(path=CACHE_FILE):
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS objects (
+            id INTEGER NOT NULL,
+            object TEXT NOT NULL,
+            subject_id INTEGER,
+            data_updated_at TEXT NOT NULL,
+            document TEXT NOT NULL,
+            PRIMARY KEY (object, id)
+        );
+        CREATE INDEX IF NOT EXISTS objects_updated ON objects (object, data_updated_at);
+        CREATE INDEX IF NOT EXISTS objects_subject ON objects (subject_id);
+
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY,
+            object TEXT NOT NULL,
+            type_code INTEGER NOT NULL,
+            level INTEGER NOT NULL,
+            data_updated_at TEXT NOT NULL,
+            document TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS subjects_updated ON subjects (data_updated_at);
+    """)
+    return conn
+
+
+def timestamp(value):
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    # Fixed width so that the text column sorts and compares chronologically
+    return value.isoformat(timespec="microseconds")
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return timestamp(value)
+    return str(value)
+
+
+def _decode(document):
+    for k in DATE_FIELDS & document.keys():
+        if isinstance(document[k], str):
+            document[k] = datetime.datetime.fromisoformat(timestamp(document[k]))
+    return document
+
+
+def store(conn, items):
+    stored = 0
+    with conn:
+        for x in items:
+            x = {k: v for k, v in x.items() if k != "_id"}
+            document = json.dumps(x, default=_encode)
+            updated = timestamp(x["data_updated_at"])
+            if x["object"] in SUBJECT_OBJECTS:
+                conn.execute("INSERT OR REPLACE INTO subjects VALUES (?, ?, ?, ?, ?, ?)",
+                             (x["id"], x["object"], subject_type_code(x["object"]), x["data"]["level"],
+                              updated, document))
+            else:
+                conn.execute("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                             (x["id"], x["object"], x["data"].get("subject_id"), updated, document))
+            stored += 1
+    return stored
+
+
+def count(conn, object_type):
+    if object_type == "subject":
+        return conn.execute("SELECT count(*) FROM subjects").fetchone()[0]
+    return conn.execute("SELECT count(*) FROM objects WHERE object = ?", (object_type,)).fetchone()[0]
+
+
+def load(conn, object_type, since=None):
+    rows = conn.execute("SELECT document FROM objects WHERE object = ? AND data_updated_at > ? "
+                        "ORDER BY data_updated_at, id",
+                        (object_type, "" if since is None else timestamp(since)))
+    return [json.loads(document, object_hook=_decode) for document, in rows]
+
+
+def load_subject(conn, subject_id):
+    row = conn.execute("SELECT document FROM subjects WHERE id = ?", (subject_id,)).fetchone()
+    if row is None:
+        raise KeyError(subject_id)
+    return json.loads(row[0], object_hook=_decode)
+
+
+def subjects_updated_at(conn):
+    return conn.execute("SELECT max(data_updated_at) FROM subjects").fetchone()[0]
+
+
+def load_review_array(conn, type_codes, since=None):
+    """
+    Reviews newer than since as a REVIEW_DTYPE array. The subject type is looked up from type_codes,
+    an array indexed by subject id. Reviews of unknown subjects are left out.
+    Only the needed fields are extracted, the review documents are never decoded in Python.
+    """
+    rows = conn.execute("""
+        SELECT r.data_updated_at,
+               r.subject_id,
+               0,
+               json_extract(r.document, '$.data.starting_srs_stage'),
+               json_extract(r.document, '$.data.ending_srs_stage'),
+               json_extract(r.document, '$.data.incorrect_meaning_answers'),
+               json_extract(r.document, '$.data.incorrect_reading_answers')
+        FROM objects r
+        WHERE r.object = 'review' AND r.data_updated_at > ?
+        ORDER BY r.data_updated_at, r.id
+    """, ("" if since is None else timestamp(since),))
+    reviews = np.array(rows.fetchall(), dtype=REVIEW_DTYPE).reshape(-1)
+    known = reviews["subject_id"] < len(type_codes)
+    known[known] = type_codes[reviews["subject_id"][known]] >= 0
+    reviews = reviews[known]
+    reviews["subject_type"] = type_codes[reviews["subject_id"]]
+    return reviews
+
+
+def load_reviews_after(conn, type_codes, watermarks):
+    """
+    One read of the reviews for several states that are kept up to date with them, the ones newer than the oldest
+    of their watermarks. A watermark of None (a state to rebuild) or NaT (a state without reviews) reads all.
+    """
+    if any(w is None or np.isnat(w) for w in watermarks):
+        return load_review_array(conn, type_codes)
+    return load_review_array(conn, type_codes, since=min(watermarks).item())
+
+
+def reviews_after(reviews, watermark):
+    # The reviews of a load_reviews_after result that a state with this watermark does not have yet
+    if watermark is None or np.isnat(watermark):
+        return reviews
+    return reviews[reviews["timestamp"] > watermark]
@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+
+from local_cache import reviews_after
+
+
+def save_npz(path, compressed=False, **arrays):
+    # Written next to path and moved over it, so an interrupted write never leaves a truncated file behind
+    temp_path = f"{path}.tmp.npz"
+    (np.savez_compressed if compressed else np.savez)(temp_path, **arrays)
+    os.replace(temp_path, path)
+
+
+def load_current(load, digest, path):
+    """
+    The state that load reads from path, or None when there is none yet or it was built for other subject types
+    than digest (subject_index.type_digest), since the subject types of the reviews in it could be stale.
+    """
+    state = load(path)
+    if state is None or state["type_digest"] != digest:
+        return None
+    return state
+
+
+def advance(state, reviews, digest, build, update, save, path):
+    """
+    Brings a review state from load_current up to date with reviews, which have to include every review after its
+    watermark, and saves it. A state of None is built with build(reviews, digest), then reviews have to be all
+    reviews; otherwise update(state, reviews) adds the reviews after the watermark.
+    """
+    if state is None:
+        state = build(reviews, digest)
+    else:
+        reviews = reviews_after(reviews, state["watermark"])
+        if len(reviews) == 0:
+            return state
+        state = update(state, reviews)
+    save(state, path)
+    return state
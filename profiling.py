@@ -0,0 +1,118 @@
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+# Set while profiling is enabled, None otherwise so that stage() costs nothing
+_stages = None
+_open = []
+_cprofile_dir = None
+_disabled = contextlib.nullcontext()
+
+
+def _after_fork():
+    # Forked workers, like the figure rendering pool, would otherwise trace every allocation they make
+    global _stages
+    _stages = None
+    _open.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def enable(cprofile_dir=None):
+    """
+    Starts recording every stage() from now on, with wall and CPU time and the peak memory allocated by Python.
+    With cprofile_dir each top level stage is also run under cProfile and its stats are saved to cprofile_dir/<stage>.prof.
+    Memory allocated in other processes, like the figure rendering pool, is not counted.
+    """
+    global _stages, _cprofile_dir
+    _stages = []
+    _cprofile_dir = cprofile_dir
+    if cprofile_dir is not None:
+        os.makedirs(cprofile_dir, exist_ok=True)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def stage(name):
+    if _stages is None:
+        return _disabled
+    return _measure(name)
+
+
+@contextlib.contextmanager
+def _measure(name):
+    current, peak = tracemalloc.get_traced_memory()
+    if _open:
+        # The parent keeps the peak it reached so far, the peak is reset for this stage
+        _open[-1]["peak"] = max(_open[-1]["peak"], peak)
+    tracemalloc.reset_peak()
+    record = {"stage": ".".join([x["stage"] for x in _open] + [name]), "peak": current, "start": current}
+    _open.append(record)
+
+    # cProfile can only run one profiler at a time, so nested stages are part of their parent's profile
+    profiler = cProfile.Profile() if _cprofile_dir is not None and len(_open) == 1 else None
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record["seconds"] = time.perf_counter() - wall
+        record["cpu_seconds"] = time.process_time() - cpu
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(record.pop("peak"), peak)
+        start = record.pop("start")
+        record["peak_bytes"] = peak - start
+        record["retained_bytes"] = current - start
+        _open.pop()
+        if _open:
+            _open[-1]["peak"] = max(_open[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+
+        if profiler is not None:
+            record["cprofile"] = os.path.join(_cprofile_dir, f"{name}.prof")
+            profiler.dump_stats(record["cprofile"])
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(10)
+            record["cprofile_top"] = text.getvalue()
+        _stages.append(record)
+
+
+def results():
+    # In the order the stages finished, so nested stages come before their parent
+    return list(_stages or [])
+
+
+def report(report_format="table", output=None):
+    if _stages is None:
+        return
+    if report_format == "json":
+        text = json.dumps({"stages": [{k: v for k, v in r.items() if k != "cprofile_top"} for r in _stages]},
+                          indent=2)
+    else:
+        rows = [f"{'stage':<30} {'seconds':>9} {'cpu':>9} {'peak MiB':>9} {'kept MiB':>9}"]
+        for r in _stages:
+            rows.append(f"{r['stage']:<30} {r['seconds']:>9.3f} {r['cpu_seconds']:>9.3f} "
+                        f"{r['peak_bytes'] / 2 ** 20:>9.1f} {r['retained_bytes'] / 2 ** 20:>9.1f}")
+        for r in _stages:
+            if "cprofile_top" in r:
+                rows.append(f"\n{r['stage']} ({r['cprofile']})\n{r['cprofile_top'].strip()}")
+        text = "\n".join(rows)
+
+    if output is None:
+        print(text, file=sys.stderr)
+    else:
+        with open(output, "w") as f:
+            f.write(text + "\n")
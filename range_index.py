@@ -0,0 +1,202 @@
+import numpy as np
+
+import persisted_state
+from persisted_state import save_npz
+from review_aggregation import SUBJECT_TYPES
+from subject_index import type_digest
+from time_buckets import week_start
+
+RANGE_INDEX_FILE = "range_index.npz"
+
+# The prefix sums kept per subject type, with the shape of one hour of each
+SUMS = {
+    "answers": (len(SUBJECT_TYPES), 4),
+    "count": (len(SUBJECT_TYPES),),
+    "level_change": (len(SUBJECT_TYPES),),
+    "correct": (len(SUBJECT_TYPES), 10),
+    "wrong": (len(SUBJECT_TYPES), 10),
+}
+
+
+def _hourly(reviews, origin, hours):
+    # The sums of every hour from origin on, (hours x the shape in SUMS) for each of SUMS
+    types = reviews["subject_type"].astype(np.intp)
+    start = reviews["starting_srs_stage"].astype(np.intp)
+    end = reviews["ending_srs_stage"].astype(np.intp)
+    incorrect_meaning = reviews["incorrect_meaning_answers"].astype(np.int64)
+    incorrect_reading = reviews["incorrect_reading_answers"].astype(np.int64)
+    answers = [incorrect_meaning + 1, incorrect_meaning, incorrect_reading + 1, incorrect_reading]
+
+    n_types = len(SUBJECT_TYPES)
+    index = (reviews["timestamp"].astype("M8[h]") - origin).astype(np.int64) * n_types + types
+    size = hours * n_types
+    correct = start < end
+    by_stage = index * 10 + start
+    return {
+        "answers": np.stack([np.bincount(index, a, size) for a in answers], axis=-1).reshape(hours, n_types, 4),
+        "count": np.bincount(index, minlength=size).reshape(hours, n_types),
+        "level_change": np.bincount(index, end - start, size).reshape(hours, n_types),
+        "correct": np.bincount(by_stage[correct], minlength=size * 10).reshape(hours, n_types, 10),
+        "wrong": np.bincount(by_stage[~correct], minlength=size * 10).reshape(hours, n_types, 10),
+    }
+
+
+def _prefix(hourly, base):
+    # Running totals of hourly on top of base, the totals before its first hour
+    return (base + np.cumsum(hourly, axis=0)).astype(np.int32)
+
+
+def build(reviews, digest):
+    """
+    Prefix sums of the answers, review counts, level changes and correct and wrong reviews by starting stage
+    on an hourly grid from the hour of the first review to that of the last.
+    Row i of every array holds the totals of all hours before origin + i, so any range of hours is a difference
+    of two rows.
+    """
+    if len(reviews):
+        origin = reviews["timestamp"].min().astype("M8[h]")
+        hours = int((reviews["timestamp"].max().astype("M8[h]") - origin).astype(np.int64)) + 1
+    else:
+        origin = np.datetime64("NaT", "h")
+        hours = 0
+    index = {k: np.zeros((1,) + shape, dtype=np.int32) for k, shape in SUMS.items()}
+    if hours:
+        for k, hourly in _hourly(reviews, origin, hours).items():
+            index[k] = np.concatenate([index[k], _prefix(hourly, 0)])
+    index["origin"] = origin
+    index["watermark"] = reviews["timestamp"].max() if len(reviews) else np.datetime64("NaT", "us")
+    index["type_digest"] = digest
+    return index
+
+
+def extend(index, reviews):
+    """
+    Adds reviews newer than the watermark of index. Only the rows from the last hour of index on are written.
+    """
+    if len(reviews) == 0:
+        return index
+    if np.isnat(index["origin"]):
+        return build(reviews, index["type_digest"])
+
+    # The last hour can already have reviews, so its totals and the rows after it are computed again
+    last = len(index["count"]) - 2
+    first = index["origin"] + last
+    hours = int((reviews["timestamp"].max().astype("M8[h]") - first).astype(np.int64)) + 1
+    extended = dict(index)
+    for k, hourly in _hourly(reviews, first, hours).items():
+        hourly[0] += index[k][last + 1] - index[k][last]
+        extended[k] = np.concatenate([index[k][:last + 1], _prefix(hourly, index[k][last])])
+    extended["watermark"] = max(index["watermark"], reviews["timestamp"].max())
+    return extended
+
+
+def save_range_index(index, path=RANGE_INDEX_FILE):
+    save_npz(path, **{k: index[k] for k in SUMS}, origin=index["origin"], watermark=index["watermark"],
+             type_digest=np.array(index["type_digest"]))
+
+
+def load_range_index(path=RANGE_INDEX_FILE):
+    try:
+        with np.load(path) as saved:
+            index = {k: saved[k] for k in saved.files}
+    except FileNotFoundError:
+        return None
+    for k in ["origin", "watermark"]:
+        index[k] = index[k][()]
+    # One written before the subject types were digested has none and is rebuilt
+    index["type_digest"] = str(index.get("type_digest", ""))
+    return index
+
+
+def load_current(subject_index, path=RANGE_INDEX_FILE):
+    return persisted_state.load_current(load_range_index, type_digest(subject_index), path)
+
+
+def advance(index, reviews, subject_index, path=RANGE_INDEX_FILE):
+    # The whole file is written again, only the rows from the last hour on are computed again
+    return persisted_state.advance(index, reviews, type_digest(subject_index), build, extend, save_range_index, path)
+
+
+def rows(index, times):
+    # The rows of the hours times fall into, clipped to the index so that any time can be queried
+    hours = len(index["count"]) - 1
+    if hours == 0:
+        return np.zeros(np.shape(times), dtype=np.int64)
+    offset = (np.asarray(times, dtype="M8[h]") - index["origin"]).astype(np.int64)
+    return np.clip(offset, 0, hours)
+
+
+def totals(index, since=None, until=None):
+    """
+    {name: totals of the hours from the one of since up to the one of until} for every prefix sum, in O(1).
+    since and until default to the start and end of the index.
+    """
+    start = 0 if since is None else rows(index, since)
+    end = len(index["count"]) - 1 if until is None else rows(index, until)
+    return {k: index[k][max(end, start)].astype(np.int64) - index[k][start] for k in SUMS}
+
+
+def accuracy(index, since=None, until=None):
+    # The share of correct reviews per subject type and starting stage in the range, NaN without reviews
+    window = totals(index, since, until)
+    total = window["correct"] + window["wrong"]
+    return np.divide(window["correct"], total, out=np.full(total.shape, np.nan), where=total > 0)
+
+
+def bucket_totals(index, edges):
+    """
+    {name: (len(edges) - 1 x the shape in SUMS)} totals of the buckets between consecutive edges, in O(1) each.
+    """
+    at = rows(index, edges)
+    return {k: np.diff(index[k][at].astype(np.int64), axis=0) for k in SUMS}
+
+
+def window_aggregates(index, since=None, until=None):
+    """
+    The daily and weekly arrays of aggregate_reviews for the reviews between since and until, straight from the index.
+    Like there, only days and weeks with reviews are included and weeks start on Monday.
+    The index only has whole hours, so since and until are rounded down to the hour.
+    """
+    if np.isnat(index["origin"]):
+        return {"days": np.zeros(0, dtype="M8[D]"), "weeks": np.zeros(0, dtype="M8[D]"),
+                **{k: np.zeros((0,) + SUMS[s], dtype=np.int64) for k, s in _AGGREGATES.items()}}
+    first = index["origin"] if since is None else max(np.datetime64(since, "h"), index["origin"])
+    last = index["origin"] + len(index["count"]) - 1 if until is None else np.datetime64(until, "h")
+    first_day = first.astype("M8[D]")
+    last_day = max(last, first).astype("M8[D]")
+
+    days = np.arange(first_day, last_day + 1)
+    day_sums = bucket_totals(index, _edges(days, first, last))
+    weeks = np.arange(week_start(first_day), week_start(last_day) + 1, 7)
+    week_sums = bucket_totals(index, _edges(weeks, first, last))
+
+    reviewed_days = day_sums["count"].any(axis=1)
+    reviewed_weeks = week_sums["count"].any(axis=1)
+    return {
+        "days": days[reviewed_days],
+        "daily_level_change": day_sums["level_change"][reviewed_days],
+        "daily_count": day_sums["count"][reviewed_days],
+        "weeks": weeks[reviewed_weeks],
+        "weekly_answers": week_sums["answers"][reviewed_weeks],
+        "weekly_count": week_sums["count"][reviewed_weeks],
+        "weekly_correct": week_sums["correct"][reviewed_weeks],
+        "weekly_wrong": week_sums["wrong"][reviewed_weeks],
+    }
+
+
+# The arrays of window_aggregates and the prefix sums they come from
+_AGGREGATES = {
+    "daily_level_change": "level_change",
+    "daily_count": "count",
+    "weekly_answers": "answers",
+    "weekly_count": "count",
+    "weekly_correct": "correct",
+    "weekly_wrong": "wrong",
+}
+
+
+def _edges(starts, first, last):
+    # The bucket edges of buckets starting at starts, with the first and last bucket cut to [first, last)
+    edges = np.concatenate([starts.astype("M8[h]"), [np.datetime64(last, "h")]])
+    edges[0] = first
+    return np.maximum(edges, first)
@@ -0,0 +1,221 @@
+import numpy as np
+
+from time_buckets import week_start
+
+SUBJECT_TYPES = ["radical", "kanji", "vocabulary"]
+ANSWER_KINDS = ["meaning_answers", "incorrect_meaning_answers", "reading_answers", "incorrect_reading_answers"]
+
+REVIEW_DTYPE = np.dtype([
+    ("timestamp", "M8[us]"),
+    ("subject_id", "<i4"),
+    ("subject_type", "i1"),
+    ("starting_srs_stage", "i1"),
+    ("ending_srs_stage", "i1"),
+    ("incorrect_meaning_answers", "<i2"),
+    ("incorrect_reading_answers", "<i2"),
+])
+
+
+def subject_type_code(object_type):
+    if object_type == "kana_vocabulary":
+        object_type = "vocabulary"
+    return SUBJECT_TYPES.index(object_type)
+
+
+def _group_sum(index, size, weights=None):
+    return np.bincount(index, weights=weights, minlength=size).astype(np.int64)
+
+
+def _bucket(keys, types):
+    buckets, inverse = np.unique(keys, return_inverse=True)
+    return buckets, inverse * len(SUBJECT_TYPES) + types
+
+
+def aggregate_reviews(reviews):
+    n_types = len(SUBJECT_TYPES)
+    types = reviews["subject_type"].astype(np.intp)
+    start = reviews["starting_srs_stage"].astype(np.intp)
+    end = reviews["ending_srs_stage"].astype(np.intp)
+    incorrect_meaning = reviews["incorrect_meaning_answers"].astype(np.int64)
+    incorrect_reading = reviews["incorrect_reading_answers"].astype(np.int64)
+    answers = [incorrect_meaning + 1, incorrect_meaning, incorrect_reading + 1, incorrect_reading]
+
+    hour = reviews["timestamp"].astype("M8[h]")
+    day = hour.astype("M8[D]")
+
+    hours, index = _bucket(hour, types)
+    size = len(hours) * n_types
+    hourly_answers = np.stack([_group_sum(index, size, a) for a in answers], axis=-1).reshape(-1, n_types, 4)
+    hourly_count = _group_sum(index, size).reshape(-1, n_types)
+
+    days, index = _bucket(day, types)
+    size = len(days) * n_types
+    daily_level_change = _group_sum(index, size, end - start).reshape(-1, n_types)
+    daily_count = _group_sum(index, size).reshape(-1, n_types)
+
+    weeks, index = _bucket(week_start(day), types)
+    size = len(weeks) * n_types
+    weekly_answers = np.stack([_group_sum(index, size, a) for a in answers], axis=-1).reshape(-1, n_types, 4)
+    weekly_count = _group_sum(index, size).reshape(-1, n_types)
+    index = index * 10 + start
+    correct = start < end
+    weekly_correct = _group_sum(index[correct], size * 10).reshape(-1, n_types, 10)
+    weekly_wrong = _group_sum(index[~correct], size * 10).reshape(-1, n_types, 10)
+
+    return {
+        "hours": hours,
+        "hourly_answers": hourly_answers,
+        "hourly_count": hourly_count,
+        "days": days,
+        "daily_level_change": daily_level_change,
+        "daily_count": daily_count,
+        "weeks": weeks,
+        "weekly_answers": weekly_answers,
+        "weekly_count": weekly_count,
+        "weekly_correct": weekly_correct,
+        "weekly_wrong": weekly_wrong,
+    }
+
+
+def time_in_stage(reviews, previous=None):
+    """
+    Minutes each subject spent on each starting stage, measured between the hours of consecutive reviews.
+    Only subjects with at least two reviews are included.
+    previous is the result for the reviews before these, which it is combined with.
+    """
+    subject_ids = reviews["subject_id"]
+    hour = reviews["timestamp"].astype("M8[h]")
+    start = reviews["starting_srs_stage"].astype(np.intp)
+    end = reviews["ending_srs_stage"].astype(np.intp)
+    if previous is not None:
+        # The last earlier review of every subject is where the first span of these reviews starts
+        subject_ids = np.concatenate([previous["last_subject_ids"], subject_ids])
+        hour = np.concatenate([previous["last_review"], hour])
+        start = np.concatenate([np.zeros(len(previous["last_stage"]), dtype=np.intp), start])
+        end = np.concatenate([previous["last_stage"].astype(np.intp), end])
+
+    order = np.argsort(subject_ids, kind="stable")
+    subject_ids = subject_ids[order]
+    hour = hour[order]
+    start = start[order]
+
+    follows = np.zeros(len(order), dtype=bool)
+    follows[1:] = subject_ids[1:] == subject_ids[:-1]
+    minutes = np.zeros(len(order))
+    minutes[1:] = (hour[1:] - hour[:-1]).astype("m8[m]").astype(np.int64)
+
+    subjects, index = np.unique(subject_ids[follows], return_inverse=True)
+    spent = np.bincount(index * 10 + start[follows],
+                        weights=minutes[follows],
+                        minlength=len(subjects) * 10).reshape(-1, 10)
+    if previous is not None:
+        subjects, (spent,) = _merge_buckets(previous["subject_ids"], subjects, (previous["spent"], spent))
+
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = ~follows[1:]
+    return {
+        "subject_ids": subjects,
+        "spent": spent,
+        "last_subject_ids": subject_ids[last],
+        "last_review": hour[last],
+        "last_stage": end[order][last].astype(np.int8),
+    }
+
+
+def subject_answers(reviews):
+    """
+    Per subject, sorted by id: the number of reviews, of incorrect answers and the streak of correct reviews
+    (without any incorrect answer) at the end.
+    """
+    order = np.argsort(reviews["subject_id"], kind="stable")
+    subject_ids = reviews["subject_id"][order]
+    incorrect = (reviews["incorrect_meaning_answers"].astype(np.int64)
+                 + reviews["incorrect_reading_answers"].astype(np.int64))[order]
+
+    subjects, first, count = np.unique(subject_ids, return_index=True, return_counts=True)
+    wrong_at = np.where(incorrect > 0, np.arange(len(order)), -1)
+    last_wrong = np.maximum.reduceat(wrong_at, first) if len(first) else np.zeros(0, dtype=np.int64)
+    return {
+        "subject_ids": subjects,
+        "reviews": count.astype(np.int64),
+        "incorrect": np.add.reduceat(incorrect, first) if len(first) else np.zeros(0, dtype=np.int64),
+        "streak": np.where(last_wrong < 0, count, first + count - 1 - last_wrong).astype(np.int64),
+    }
+
+
+def merge_subject_answers(old, new):
+    # Combines the subject_answers of two sets of reviews, new being the later one
+    subject_ids, (reviews, incorrect) = _merge_buckets(old["subject_ids"], new["subject_ids"],
+                                                       (old["reviews"], new["reviews"]),
+                                                       (old["incorrect"], new["incorrect"]))
+    # A streak without any incorrect review in new continues the one of old
+    streak = np.zeros(len(subject_ids), dtype=np.int64)
+    streak[np.searchsorted(subject_ids, old["subject_ids"])] = old["streak"]
+    new_rows = np.searchsorted(subject_ids, new["subject_ids"])
+    unbroken = new["streak"] == new["reviews"]
+    streak[new_rows] = np.where(unbroken, streak[new_rows], 0) + new["streak"]
+    return {"subject_ids": subject_ids, "reviews": reviews, "incorrect": incorrect, "streak": streak}
+
+
+def stage_history(reviews, subject_type, previous=None):
+    """
+    Number of subjects of one type on each srs stage at the end of every hour with reviews of that type.
+    Returns the hours and a (hours x 10) array of counts.
+    previous continues the history of the reviews before these. It is (hours, counts, last_subject_ids, last_stage),
+    the last two as returned by time_in_stage for those reviews.
+    """
+    reviews = reviews[reviews["subject_type"] == subject_type]
+    hour = reviews["timestamp"].astype("M8[h]")
+    order = np.argsort(hour, kind="stable")
+    hour = hour[order]
+    subject_ids = reviews["subject_id"][order]
+    stage = reviews["ending_srs_stage"][order].astype(np.intp)
+
+    # Every review moves its subject from the stage of its previous review to its ending stage.
+    by_subject = np.argsort(subject_ids, kind="stable")
+    follows = subject_ids[by_subject][1:] == subject_ids[by_subject][:-1]
+    previous_stage = np.full(len(order), -1)
+    previous_stage[by_subject[1:][follows]] = stage[by_subject[:-1][follows]]
+    if previous is not None:
+        old_hours, old_counts, last_subject_ids, last_stage = previous
+        first = np.flatnonzero(previous_stage < 0)
+        at = np.minimum(np.searchsorted(last_subject_ids, subject_ids[first]), max(len(last_subject_ids) - 1, 0))
+        known = last_subject_ids[at] == subject_ids[first] if len(last_subject_ids) else np.zeros(len(first), bool)
+        previous_stage[first[known]] = last_stage[at[known]]
+
+    hours, index = np.unique(hour, return_inverse=True)
+    size = len(hours) * 10
+    moved = previous_stage >= 0
+    delta = _group_sum(index * 10 + stage, size) - _group_sum(index[moved] * 10 + previous_stage[moved], size)
+    counts = np.cumsum(delta.reshape(-1, 10), axis=0)
+    if previous is not None:
+        if len(old_counts):
+            counts += old_counts[-1]
+        # An hour split between the two sets of reviews is replaced by its combined counts
+        keep = old_hours < hours[0] if len(hours) else np.ones(len(old_hours), dtype=bool)
+        hours = np.concatenate([old_hours[keep], hours])
+        counts = np.concatenate([old_counts[keep], counts])
+    return hours, counts
+
+
+def _merge_buckets(old_keys, new_keys, *pairs):
+    # Adds up the (old, new) arrays of each pair, whose rows belong to the sorted old_keys and new_keys
+    keys = np.union1d(old_keys, new_keys)
+    old_rows = np.searchsorted(keys, old_keys)
+    new_rows = np.searchsorted(keys, new_keys)
+    merged = []
+    for old, new in pairs:
+        total = np.zeros((len(keys),) + old.shape[1:], dtype=np.result_type(old, new))
+        total[old_rows] += old
+        total[new_rows] += new
+        merged.append(total)
+    return keys, merged
+
+
+def merge_time_in_stage(old, new):
+    """
+    Combines the time_in_stage results of two sets of reviews, where new was computed with the carry-over of old
+    (or of all reviews before new), so its spans and last reviews already continue old.
+    """
+    subject_ids, (spent,) = _merge_buckets(old["subject_ids"], new["subject_ids"], (old["spent"], new["spent"]))
+    return dict(new, subject_ids=subject_ids, spent=spent)
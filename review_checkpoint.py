@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+
+import persisted_state
+import review_shards
+from local_cache import load_review_array, load_reviews_after
+from persisted_state import save_npz
+from review_aggregation import SUBJECT_TYPES, merge_subject_answers, stage_history, subject_answers, time_in_stage
+from subject_index import type_digest
+
+CHECKPOINT_FILE = "review_checkpoint.npz"
+
+TIME_IN_STAGE_KEYS = ["subject_ids", "spent", "last_subject_ids", "last_review", "last_stage"]
+SUBJECT_ANSWER_KEYS = ["subject_ids", "reviews", "incorrect", "streak"]
+
+
+def build(reviews, digest, workers=None):
+    """
+    The time in stage, stage histories and subject answers of all reviews, plus the watermark of the newest review
+    included. The hourly, daily and weekly sums are kept by the range index instead.
+    Enough reviews are aggregated over time shards in up to workers processes, which defaults to the CPU count.
+    """
+    shards = min(workers or os.cpu_count(), len(reviews) // review_shards.MIN_SHARD_REVIEWS)
+    if shards > 1:
+        state = review_shards.aggregate(reviews, shards)
+    else:
+        state = {
+            "time_in_stage": time_in_stage(reviews),
+            "histories": [stage_history(reviews, i) for i in range(len(SUBJECT_TYPES))],
+            "subject_answers": subject_answers(reviews),
+        }
+    state["watermark"] = reviews["timestamp"].max() if len(reviews) else np.datetime64("NaT", "us")
+    state["type_digest"] = digest
+    return state
+
+
+def update(state, reviews):
+    # Folds reviews newer than the watermark into state
+    if len(reviews) == 0:
+        return state
+    previous = state["time_in_stage"]
+    return {
+        "time_in_stage": time_in_stage(reviews, previous),
+        "histories": [stage_history(reviews, i, (hours, counts, previous["last_subject_ids"], previous["last_stage"]))
+                      for i, (hours, counts) in enumerate(state["histories"])],
+        "subject_answers": merge_subject_answers(state["subject_answers"], subject_answers(reviews)),
+        "watermark": reviews["timestamp"].max(),
+        "type_digest": state["type_digest"],
+    }
+
+
+def save_checkpoint(state, path=CHECKPOINT_FILE):
+    arrays = dict(state["time_in_stage"])
+    for t, (hours, counts) in zip(SUBJECT_TYPES, state["histories"]):
+        arrays[f"history_hours_{t}"] = hours
+        arrays[f"history_counts_{t}"] = counts
+    arrays.update({f"answers_{k}": state["subject_answers"][k] for k in SUBJECT_ANSWER_KEYS})
+    save_npz(path, watermark=state["watermark"], type_digest=np.array(state["type_digest"]), **arrays)
+
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    try:
+        with np.load(path) as saved:
+            arrays = {k: saved[k] for k in saved.files}
+    except FileNotFoundError:
+        return None
+    if "answers_streak" not in arrays or "type_digest" not in arrays:
+        # Written before the subject answers were checkpointed or the subject types digested, so it is rebuilt
+        return None
+    return {
+        "time_in_stage": {k: arrays[k] for k in TIME_IN_STAGE_KEYS},
+        "histories": [(arrays[f"history_hours_{t}"], arrays[f"history_counts_{t}"]) for t in SUBJECT_TYPES],
+        "subject_answers": {k: arrays[f"answers_{k}"] for k in SUBJECT_ANSWER_KEYS},
+        "watermark": arrays["watermark"][()],
+        "type_digest": str(arrays["type_digest"]),
+    }
+
+
+def load_current(subject_index, path=CHECKPOINT_FILE):
+    return persisted_state.load_current(load_checkpoint, type_digest(subject_index), path)
+
+
+def advance(state, reviews, subject_index, path=CHECKPOINT_FILE):
+    return persisted_state.advance(state, reviews, type_digest(subject_index), build, update, save_checkpoint, path)
+
+
+def refresh(conn, subject_index, path=CHECKPOINT_FILE):
+    """
+    The checkpointed review state, brought up to date with only the reviews cached after its watermark.
+    """
+    state = load_current(subject_index, path)
+    reviews = load_reviews_after(conn, subject_index["type_code"], [None if state is None else state["watermark"]])
+    return advance(state, reviews, subject_index, path)
+
+
+def verify(conn, subject_index, path=CHECKPOINT_FILE):
+    """
+    Refreshes the checkpoint and compares it against a rebuild from all reviews in a single process.
+    Returns the names of the arrays that differ.
+    """
+    incremental = refresh(conn, subject_index, path)
+    full = build(load_review_array(conn, subject_index["type_code"]), type_digest(subject_index), workers=1)
+
+    differences = [k for k in TIME_IN_STAGE_KEYS
+                    if not np.array_equal(incremental["time_in_stage"][k], full["time_in_stage"][k])]
+    differences += [f"answers_{k}" for k in SUBJECT_ANSWER_KEYS
+                    if not np.array_equal(incremental["subject_answers"][k], full["subject_answers"][k])]
+    for t, a, b in zip(SUBJECT_TYPES, incremental["histories"], full["histories"]):
+        differences += [f"history_{k}_{t}" for k, x, y in zip(["hours", "counts"], a, b) if not np.array_equal(x, y)]
+    if str(incremental["watermark"]) != str(full["watermark"]):
+        differences.append("watermark")
+    return differences
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from local_cache import CACHE_FILE, connect
+    from subject_index import load_index
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache", default=CACHE_FILE)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--verify", action="store_true",
+                        help="compare the incrementally updated checkpoint against a rebuild from all reviews")
+    args = parser.parse_args()
+
+    conn = connect(args.cache)
+    if args.verify:
+        differences = verify(conn, load_index(conn), args.checkpoint)
+        if differences:
+            raise SystemExit(f"checkpoint differs from a full rebuild in: {', '.join(differences)}")
+        print("checkpoint matches a full rebuild")
+    else:
+        state = refresh(conn, load_index(conn), args.checkpoint)
+        print(f"checkpoint covers reviews up to {state['watermark']}")
@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from review_aggregation import SUBJECT_TYPES, merge_subject_answers, merge_time_in_stage, stage_history, \
+    subject_answers, time_in_stage
+
+# Below this many reviews per worker starting the pool and sending the shards costs more than it saves
+MIN_SHARD_REVIEWS = 100000
+
+
+def split(reviews, shards):
+    """
+    Splits reviews sorted by time into shards of consecutive time ranges with about the same number of reviews.
+    """
+    return np.array_split(reviews, shards)
+
+
+def _last_reviews(reviews):
+    # The last review of every subject, in the form time_in_stage returns and takes as carry-over
+    subject_ids, last = np.unique(reviews["subject_id"][::-1], return_index=True)
+    last = len(reviews) - 1 - last
+    return {
+        "last_subject_ids": subject_ids,
+        "last_review": reviews["timestamp"][last].astype("M8[h]"),
+        "last_stage": reviews["ending_srs_stage"][last],
+    }
+
+
+def _carry(before, lasts):
+    # The last reviews up to the end of a shard from the ones before it and the shard's own
+    subject_ids = np.union1d(before["last_subject_ids"], lasts["last_subject_ids"])
+    carry = dict()
+    for k in ["last_review", "last_stage"]:
+        carry[k] = np.zeros(len(subject_ids), dtype=lasts[k].dtype)
+        carry[k][np.searchsorted(subject_ids, before["last_subject_ids"])] = before[k]
+        carry[k][np.searchsorted(subject_ids, lasts["last_subject_ids"])] = lasts[k]
+    carry["last_subject_ids"] = subject_ids
+    return carry
+
+
+def _map_independent(reviews):
+    # Everything of a shard that does not depend on the reviews before it
+    return subject_answers(reviews), _last_reviews(reviews)
+
+
+def _map_carried(reviews, carry):
+    # The per subject state of a shard, continued from the last reviews before it. The time in stage only covers
+    # the spans that end in this shard and the stage histories count from zero, the reduce adds up the rest.
+    previous = dict(carry, subject_ids=np.zeros(0, dtype=carry["last_subject_ids"].dtype), spent=np.zeros((0, 10)))
+    histories = [stage_history(reviews, i, (np.zeros(0, dtype="M8[h]"), np.zeros((0, 10), dtype=np.int64),
+                                            carry["last_subject_ids"], carry["last_stage"]))
+                 for i in range(len(SUBJECT_TYPES))]
+    return time_in_stage(reviews, previous), histories
+
+
+def _reduce_histories(old, new):
+    # Continues a stage history with the counts of the next shard, which start from zero
+    old_hours, old_counts = old
+    hours, counts = new
+    if len(hours) == 0:
+        return old
+    if len(old_counts):
+        counts = counts + old_counts[-1]
+    # An hour split between two shards is replaced by its combined counts
+    keep = old_hours < hours[0]
+    return np.concatenate([old_hours[keep], hours]), np.concatenate([old_counts[keep], counts])
+
+
+def aggregate(reviews, workers=None, shards=None):
+    """
+    The time_in_stage, per type stage_history and subject_answers results of reviews sorted by time,
+    computed in a process pool over time shards. The result is the same as the single process one.
+
+    The subject answers of every shard are independent and simply merged. The time in stage and stage histories need
+    the last review of every subject before a shard, so after the first pass, which also collects the last reviews
+    of every shard, these are carried over from shard to shard and the per subject state is computed in a second.
+    """
+    workers = workers or os.cpu_count()
+    shards = shards or workers
+    parts = split(reviews, shards)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        independent = list(executor.map(_map_independent, parts))
+
+        carries = [_last_reviews(reviews[:0])]
+        for _, lasts in independent[:-1]:
+            carries.append(_carry(carries[-1], lasts))
+        carried = list(executor.map(_map_carried, parts, carries))
+
+    answers, _ = independent[0]
+    for shard_answers, _ in independent[1:]:
+        answers = merge_subject_answers(answers, shard_answers)
+
+    stage_time = carried[0][0]
+    histories = carried[0][1]
+    for shard_time, shard_histories in carried[1:]:
+        stage_time = merge_time_in_stage(stage_time, shard_time)
+        histories = [_reduce_histories(old, new) for old, new in zip(histories, shard_histories)]
+    return {"time_in_stage": stage_time, "histories": histories, "subject_answers": answers}
@@ -0,0 +1,107 @@
+import json
+import os
+
+import numpy as np
+
+from assignment_archive import ASSIGNMENT_TYPES, COUNT_ROWS
+from review_aggregation import SUBJECT_TYPES
+from time_buckets import parse_timestamps
+
+# One fixed-width record per snapshot: when it was taken and the item count
+# of every (subject type, srs stage) pair.
+SNAPSHOT_DTYPE = np.dtype([
+    ("timestamp", "M8[us]"),
+    ("counts", "<i4", (len(SUBJECT_TYPES), 10)),
+])
+
+
+# Row of every subject type of the JSON snapshots in the counts, the same as in assignment_archive.stage_counts
+_TYPE_ROWS = dict(zip(ASSIGNMENT_TYPES, COUNT_ROWS.tolist()))
+_STAGES = {str(s): s for s in range(10)}
+
+
+def append_snapshot(path, timestamp, counts):
+    append_snapshots(path, [timestamp], [counts])
+
+
+def append_snapshots(path, timestamps, counts):
+    # Several snapshots are written and synced to disk together
+    records = np.zeros(len(timestamps), dtype=SNAPSHOT_DTYPE)
+    records["timestamp"] = [np.datetime64(t, "us") for t in timestamps]
+    records["counts"] = counts
+
+    with open(path, "ab") as f:
+        # A crash during an earlier append can leave a partial record behind.
+        end = f.seek(0, os.SEEK_END)
+        torn = end % SNAPSHOT_DTYPE.itemsize
+        if torn:
+            f.truncate(end - torn)
+        f.write(records.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_snapshots(path):
+    try:
+        size = os.path.getsize(path) // SNAPSHOT_DTYPE.itemsize
+    except FileNotFoundError:
+        size = 0
+    if size == 0:
+        return np.zeros(0, dtype=SNAPSHOT_DTYPE)
+    return np.memmap(path, dtype=SNAPSHOT_DTYPE, mode="r", shape=(size,))
+
+
+def snapshots_from_json(data):
+    """
+    A JSON snapshot history ({date: {subject type: {stage: count}}}) as SNAPSHOT_DTYPE records.
+    Every cell is visited once and all of them are summed into the dense counts array in one go.
+    """
+    index = []
+    counts = []
+    for i, totals in enumerate(data.values()):
+        for t, stages in totals.items():
+            row = (i * len(SUBJECT_TYPES) + _TYPE_ROWS[t]) * 10
+            index.extend([row + _STAGES[s] for s in stages])
+            counts.extend(stages.values())
+
+    records = np.zeros(len(data), dtype=SNAPSHOT_DTYPE)
+    records["timestamp"] = parse_timestamps(data.keys())
+    records["counts"] = np.bincount(np.array(index, dtype=np.intp), weights=np.array(counts, dtype=np.float64),
+                                    minlength=len(data) * len(SUBJECT_TYPES) * 10).reshape(-1, len(SUBJECT_TYPES), 10)
+    return records
+
+
+def load_json_snapshots(json_path):
+    with open(json_path, "r") as f:
+        return snapshots_from_json(json.load(f))
+
+
+def import_json(json_path, store_path):
+    """
+    Merges a JSON snapshot history into the store, which may already have snapshots appended by the collector.
+    The result is sorted by time, where both have a snapshot at the same time the one in the store is kept.
+    Returns the number of snapshots added.
+    """
+    existing = np.array(load_snapshots(store_path))
+    merged = np.concatenate([existing, load_json_snapshots(json_path)])
+    # np.unique returns the first of every time, which is the one already in the store
+    _, first = np.unique(merged["timestamp"], return_index=True)
+    records = merged[first]
+
+    temp_path = f"{store_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(records.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, store_path)
+    return len(records) - len(existing)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import a JSON snapshot history into a new or existing snapshot store")
+    parser.add_argument("json_path", help="e.g. wanikani_perf.json or simplejson_out.json")
+    parser.add_argument("store_path", help="e.g. wanikani_perf.snapshots or simplejson_out.snapshots")
+    args = parser.parse_args()
+    print(f"Imported {import_json(args.json_path, args.store_path)} snapshots")
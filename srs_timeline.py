@@ -0,0 +1,218 @@
+import numpy as np
+
+import persisted_state
+from local_cache import reviews_after
+from persisted_state import save_npz
+from review_aggregation import SUBJECT_TYPES
+from subject_index import type_digest
+
+TIMELINE_FILE = "srs_timeline.npz"
+
+# A keyframe of the full state is kept every this many events, so a query never replays more than these
+KEYFRAME_EVENTS = 10000
+
+# A subject moving to a stage at a time, from a review or the unlock (stage 0) and lesson (stage 1) of its assignment
+EVENT_DTYPE = np.dtype([
+    ("time", "M8[us]"),
+    ("subject_id", "<i4"),
+    ("stage", "i1"),
+])
+
+
+def review_events(reviews):
+    events = np.zeros(len(reviews), dtype=EVENT_DTYPE)
+    events["time"] = reviews["timestamp"]
+    events["subject_id"] = reviews["subject_id"]
+    events["stage"] = reviews["ending_srs_stage"]
+    return events
+
+
+def assignment_events(assignments, since=None):
+    # The unlock and lesson of every assignment of an assignment_archive projection, after since when given
+    parts = []
+    for field, stage in [("unlocked_at", 0), ("started_at", 1)]:
+        done = ~np.isnat(assignments[field])
+        if since is not None and not np.isnat(since):
+            done &= assignments[field] > since
+        events = np.zeros(int(done.sum()), dtype=EVENT_DTYPE)
+        events["time"] = assignments[field][done]
+        events["subject_id"] = assignments["subject_id"][done]
+        events["stage"] = stage
+        parts.append(events)
+    return np.concatenate(parts)
+
+
+def _subject_types(subject_types, subject_ids, types):
+    # The type of every subject id seen so far, -1 for unknown ids
+    size = max(len(subject_types), int(subject_ids.max()) + 1 if len(subject_ids) else 0)
+    grown = np.full(size, -1, dtype=np.int8)
+    grown[:len(subject_types)] = subject_types
+    grown[subject_ids] = types
+    return grown
+
+
+def _replay(state, events):
+    # Applies events in order to state, only the last event of every subject matters
+    subject_ids, last = np.unique(events["subject_id"][::-1], return_index=True)
+    state[subject_ids] = events["stage"][::-1][last]
+    return state
+
+
+def _keyframes(events, size, keyframes=None, first=0):
+    """
+    keyframes[k] is the stage of every subject id (-1 before its first event) before events[k * KEYFRAME_EVENTS].
+    The keyframes up to first are taken from keyframes, the later ones are replayed from there.
+    """
+    count = len(events) // KEYFRAME_EVENTS + 1
+    frames = np.full((count, size), -1, dtype=np.int8)
+    if keyframes is not None:
+        frames[:first + 1, :keyframes.shape[1]] = keyframes[:first + 1]
+    for k in range(first, count - 1):
+        frames[k + 1] = _replay(frames[k].copy(), events[k * KEYFRAME_EVENTS:(k + 1) * KEYFRAME_EVENTS])
+    return frames
+
+
+def build(events, subject_types):
+    """
+    The timeline of events, with the events sorted by time and a permutation that sorts them by subject,
+    plus keyframes of the full state. subject_types is the type code of every subject id, -1 if unknown.
+    """
+    return extend({
+        "events": np.zeros(0, dtype=EVENT_DTYPE),
+        "by_subject": np.zeros(0, dtype=np.int64),
+        "keyframes": np.full((1, len(subject_types)), -1, dtype=np.int8),
+        "subject_type": subject_types,
+        "watermark": np.datetime64("NaT", "us"),
+        "assignments_watermark": np.datetime64("NaT", "us"),
+        "type_digest": "",
+    }, events)
+
+
+def extend(timeline, events, subject_types=None):
+    """
+    Adds events to the timeline. They are usually newer than all events in it, but do not have to be:
+    the keyframes from the one before the earliest new event on are replayed again.
+    subject_types updates the types of the subject ids, as an array indexed by subject id.
+    """
+    if subject_types is not None:
+        known = np.flatnonzero(subject_types >= 0)
+        timeline = dict(timeline, subject_type=_subject_types(timeline["subject_type"], known, subject_types[known]))
+    if len(events) == 0:
+        return timeline
+
+    combined = np.concatenate([timeline["events"], events])
+    order = np.argsort(combined["time"], kind="stable")
+    combined = combined[order]
+    # Everything before the first event that moved, or the first new one, is unchanged
+    moved = np.flatnonzero(order[:len(timeline["events"])] != np.arange(len(timeline["events"])))
+    first_new = moved[0] if len(moved) else len(timeline["events"])
+
+    size = max(len(timeline["subject_type"]), int(combined["subject_id"].max()) + 1)
+    subject_type = np.full(size, -1, dtype=np.int8)
+    subject_type[:len(timeline["subject_type"])] = timeline["subject_type"]
+    return dict(timeline,
+                events=combined,
+                # Stable, so the events of every subject stay in time order
+                by_subject=np.argsort(combined["subject_id"], kind="stable"),
+                keyframes=_keyframes(combined, size, timeline["keyframes"], first_new // KEYFRAME_EVENTS),
+                subject_type=subject_type)
+
+
+def stage_at(timeline, subject_id, time):
+    # The stage of one subject at time, -1 before its first event
+    by_subject = timeline["by_subject"]
+    subject_ids = timeline["events"]["subject_id"][by_subject]
+    low, high = np.searchsorted(subject_ids, [subject_id, subject_id + 1])
+    events = timeline["events"][by_subject[low:high]]
+    at = np.searchsorted(events["time"], np.datetime64(time, "us"), side="right")
+    return int(events["stage"][at - 1]) if at else -1
+
+
+def state_at(timeline, time):
+    """
+    The stage of every subject id at time (including events at exactly time), -1 before its first event.
+    Costs a binary search and the replay of less than KEYFRAME_EVENTS events from the keyframe before time.
+    """
+    end = np.searchsorted(timeline["events"]["time"], np.datetime64(time, "us"), side="right")
+    k = end // KEYFRAME_EVENTS
+    state = timeline["keyframes"][k].copy()
+    return _replay(state, timeline["events"][k * KEYFRAME_EVENTS:end])
+
+
+def counts_at(timeline, time):
+    # The (subject type x srs stage) counts of the subjects with a stage at time, like a snapshot taken then
+    state = state_at(timeline, time)
+    types = timeline["subject_type"][:len(state)]
+    known = (state >= 0) & (types >= 0)
+    return np.bincount(types[known].astype(np.intp) * 10 + state[known],
+                       minlength=len(SUBJECT_TYPES) * 10).reshape(len(SUBJECT_TYPES), 10).astype(np.int32)
+
+
+def save_timeline(timeline, path=TIMELINE_FILE):
+    save_npz(path, **timeline)
+
+
+def load_timeline(path=TIMELINE_FILE):
+    try:
+        with np.load(path) as saved:
+            timeline = {k: saved[k] for k in saved.files}
+    except FileNotFoundError:
+        return None
+    for k in ["watermark", "assignments_watermark"]:
+        timeline[k] = timeline[k][()]
+    # One written before the subject types were digested has none and is rebuilt
+    timeline["type_digest"] = str(timeline.get("type_digest", ""))
+    return timeline
+
+
+def load_current(subject_index, path=TIMELINE_FILE):
+    return persisted_state.load_current(load_timeline, type_digest(subject_index), path)
+
+
+def advance(timeline, reviews, assignments, subject_index, path=TIMELINE_FILE):
+    """
+    Extends timeline from load_current with reviews, which have to include every review after its watermark,
+    and the unlocks and lessons of assignments (an assignment_archive projection) after the newest one in it,
+    and saves it. A timeline of None is rebuilt, then reviews have to be all reviews.
+    """
+    type_codes = subject_index["type_code"]
+    if timeline is not None:
+        reviews = reviews_after(reviews, timeline["watermark"])
+    unlocks = assignment_events(assignments, None if timeline is None else timeline["assignments_watermark"])
+    if timeline is not None and len(reviews) == 0 and len(unlocks) == 0:
+        return timeline
+
+    events = np.concatenate([unlocks, review_events(reviews)])
+    if timeline is None:
+        timeline = build(events, type_codes)
+    else:
+        timeline = extend(timeline, events, type_codes)
+    if len(reviews):
+        timeline["watermark"] = reviews["timestamp"].max()
+    if len(unlocks):
+        timeline["assignments_watermark"] = unlocks["time"].max() if np.isnat(timeline["assignments_watermark"]) \
+            else max(timeline["assignments_watermark"], unlocks["time"].max())
+    timeline["type_digest"] = type_digest(subject_index)
+    save_timeline(timeline, path)
+    return timeline
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--timeline", default=TIMELINE_FILE, help="the timeline charter_v2 keeps up to date")
+    parser.add_argument("--at", required=True, help="the date or time to reconstruct, e.g. 2021-06-01T12:00")
+    parser.add_argument("--subject", type=int, nargs="+", help="only print the stage of these subject ids")
+    args = parser.parse_args()
+
+    timeline = load_timeline(args.timeline)
+    if timeline is None:
+        raise SystemExit(f"no timeline in {args.timeline}, run charter_v2 first")
+    at = np.datetime64(args.at, "us")
+    if args.subject:
+        for subject_id in args.subject:
+            print(f"{subject_id:>7} {stage_at(timeline, subject_id, at)}")
+    else:
+        for name, counts in zip(SUBJECT_TYPES, counts_at(timeline, at).tolist()):
+            print(f"{name:<10} {' '.join(f'{n:>5}' for n in counts)}")
@@ -0,0 +1,68 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from local_cache import load_subject, subjects_updated_at
+from persisted_state import save_npz
+
+INDEX_FILE = "subject_index.npz"
+
+
+def build_index(conn):
+    rows = np.array(conn.execute("SELECT id, type_code, level FROM subjects").fetchall(), dtype=np.int64).reshape(-1, 3)
+    size = rows[:, 0].max() + 1 if len(rows) else 0
+    type_code = np.full(size, -1, dtype=np.int8)
+    level = np.zeros(size, dtype=np.int8)
+    type_code[rows[:, 0]] = rows[:, 1]
+    level[rows[:, 0]] = rows[:, 2]
+    return {"type_code": type_code, "level": level, "updated_at": np.array(subjects_updated_at(conn) or "")}
+
+
+def load_index(conn, path=INDEX_FILE):
+    """
+    The compact subject index: type codes and levels in arrays indexed by subject id.
+    Rebuilt and persisted again only when the cached subjects have changed since it was saved.
+    """
+    try:
+        with np.load(path) as saved:
+            index = {k: saved[k] for k in saved.files}
+        if str(index["updated_at"]) == (subjects_updated_at(conn) or ""):
+            return index
+    except FileNotFoundError:
+        pass
+
+    index = build_index(conn)
+    save_npz(path, **index)
+    return index
+
+
+def type_digest(index):
+    """
+    A digest of the subject type of every subject id. The review states built from the cache only depend on these,
+    so unlike the updated_at of the subjects it does not change when the content of a subject is edited.
+    """
+    return hashlib.sha1(np.ascontiguousarray(index["type_code"]).tobytes()).hexdigest()
+
+
+class SubjectStore:
+    """
+    Full subject documents read from the cache on first use, keeping only the most recently used ones in memory.
+    """
+
+    def __init__(self, conn, maxsize=256):
+        self.conn = conn
+        self.maxsize = maxsize
+        self.documents = OrderedDict()
+
+    def __getitem__(self, subject_id):
+        subject_id = int(subject_id)
+        if subject_id in self.documents:
+            self.documents.move_to_end(subject_id)
+            return self.documents[subject_id]
+
+        document = load_subject(self.conn, subject_id)
+        self.documents[subject_id] = document
+        if len(self.documents) > self.maxsize:
+            self.documents.popitem(last=False)
+        return document
@@ -0,0 +1,94 @@
+import numpy as np
+
+# The stages whose time in stage is added up for each ranking of the slowest subjects
+STAGE_GROUPS = {
+    "apprentice": [1, 2, 3, 4],
+    "guru": [5, 6],
+    "master": [7],
+    "enlightened": [8],
+    "burned": [9],
+}
+
+
+def parse_stage_groups(specs):
+    """
+    Stage groups from "name=stages" strings, where stages are comma separated stages or ranges like 1-4.
+    Raises ValueError for a malformed spec or a name given twice.
+    """
+    groups = dict()
+    for spec in specs:
+        name, _, stages = spec.partition("=")
+        if name in groups:
+            raise ValueError(f"Stage group {name} is given more than once")
+        ranges = [part.partition("-") for part in stages.split(",")]
+        # Checked before int() sees them, so an empty or non-numeric part is reported like any other mistake
+        if name and all(first.isdecimal() and (last if dash else first).isdecimal() for first, dash, last in ranges):
+            groups[name] = [s for first, dash, last in ranges
+                            for s in range(int(first), int(last if dash else first) + 1)]
+        if not groups.get(name) or not all(0 <= s <= 9 for s in groups[name]):
+            raise ValueError(f"Invalid stage group {spec}, expected e.g. apprentice=1-4 or early=1,2")
+    return groups
+
+
+def top_k(values, k):
+    """
+    Indices of the k largest values, largest first, without sorting all of them.
+    Equal values are ordered by index, as a stable full sort would.
+    """
+    k = min(k, len(values))
+    if k == 0:
+        return np.zeros(0, dtype=np.intp)
+    kth = np.partition(values, len(values) - k)[len(values) - k]
+    above = np.flatnonzero(values > kth)
+    chosen = np.concatenate([above, np.flatnonzero(values == kth)[:k - len(above)]])
+    return chosen[np.lexsort((chosen, -values[chosen]))]
+
+
+def group_minutes(spent, groups=STAGE_GROUPS):
+    # (subjects x groups) minutes spent on the stages of every group
+    return np.stack([spent[:, stages].sum(axis=1) for stages in groups.values()], axis=1)
+
+
+def leech_scores(answers):
+    """
+    The incorrect answers of every subject of subject_answers divided by its current streak of correct reviews
+    to the power of 1.5, so subjects that are often wrong and have not been right for long score highest.
+    """
+    return answers["incorrect"] / np.maximum(answers["streak"], 1) ** 1.5
+
+
+def rank(time_in_stage, answers, k=20, groups=STAGE_GROUPS):
+    """
+    {ranking: (subject ids, values)} with the k subjects that spent the most minutes on the stages of every group,
+    and the k with the highest leech score under "leeches".
+    """
+    minutes = group_minutes(time_in_stage["spent"], groups)
+    rankings = dict()
+    for i, name in enumerate(groups):
+        top = top_k(minutes[:, i], k)
+        rankings[name] = (time_in_stage["subject_ids"][top], minutes[top, i])
+    scores = leech_scores(answers)
+    top = top_k(scores, k)
+    rankings["leeches"] = (answers["subject_ids"][top], scores[top])
+    return rankings
+
+
+def subject_label(subject):
+    # Radicals without characters only have an image, their slug names them instead
+    data = subject["data"]
+    return data.get("characters") or data.get("slug") or str(subject["id"])
+
+
+def format_rankings(rankings, subjects):
+    """
+    One compact "id characters value" row per ranked subject, the time in stage in minutes.
+    subjects maps subject ids to documents, like a SubjectStore, and is only asked for the ranked ones.
+    """
+    lines = []
+    for name, (subject_ids, values) in rankings.items():
+        lines.append(f"{name} ({'leech score' if name == 'leeches' else 'minutes'})")
+        for subject_id, value in zip(subject_ids.tolist(), values.tolist()):
+            value = f"{value:.2f}" if name == "leeches" else f"{value:.0f}"
+            lines.append(f"{subject_id:>7} {subject_label(subjects[subject_id])} {value}")
+        lines.append("")
+    return "\n".join(lines)
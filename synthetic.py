@@ -0,0 +1,125 @@
+import datetime
+
+import numpy as np
+
+from forecast import SRS_INTERVALS, next_stage
+from review_aggregation import REVIEW_DTYPE, SUBJECT_TYPES
+
+# Subjects unlocked per level and the chance that a review of them is answered correctly
+SUBJECTS_PER_LEVEL = [8, 33, 110]
+PASS_RATES = [0.92, 0.82, 0.86]
+
+
+def _dates(start, hours):
+    times = np.datetime64(start, "us") + (np.asarray(hours) * 3600e6).astype("m8[us]")
+    return times.astype(object).tolist()
+
+
+def generate(years=1, seed=0, start=datetime.datetime(2020, 1, 1), level_days=10):
+    """
+    A deterministic, made up account of the given number of years, for benchmarks.
+    A new level is unlocked every level_days on average, with new subjects each time,
+    so the amount of data grows linearly with years.
+
+    Returns {"subjects", "reviews", "assignments", "level_progressions", "end"}.
+    reviews is a REVIEW_DTYPE array, the rest are documents as they are stored in the local cache.
+    """
+    rng = np.random.default_rng(seed)
+    total_hours = years * 365 * 24
+
+    level_hours = np.cumsum(rng.uniform(0.7, 1.3, size=int(years * 365 / level_days) + 1) * level_days * 24)
+    level_hours = np.concatenate([[0.0], level_hours[level_hours < total_hours]])
+
+    per_level = sum(SUBJECTS_PER_LEVEL)
+    level_of = np.repeat(np.arange(len(level_hours)), per_level)
+    type_code = np.tile(np.repeat(np.arange(len(SUBJECT_TYPES)), SUBJECTS_PER_LEVEL), len(level_hours)).astype(np.int8)
+    n = len(level_of)
+    subject_ids = np.arange(1, n + 1)
+
+    # Lessons are done within two days of the level up
+    started = level_hours[level_of] + rng.uniform(0, 48, size=n)
+    stage = np.ones(n, dtype=np.int8)
+    due = started + SRS_INTERVALS[0]
+    passed = np.full(n, np.nan)
+    burned = np.full(n, np.nan)
+    pass_rate = np.array(PASS_RATES)[type_code]
+
+    rounds = []
+    active = np.flatnonzero(due < total_hours)
+    while len(active):
+        # Reviews are done some hours after they become available
+        at = due[active] + rng.exponential(6, size=len(active))
+        at_stage = stage[active]
+        correct = rng.random(len(active)) < pass_rate[active]
+        end_stage = next_stage(at_stage, correct)
+
+        wrong_meaning = np.where(correct, 0, rng.integers(0, 3, size=len(active)))
+        wrong_reading = np.where(correct | (type_code[active] == 0), 0, rng.integers(0, 3, size=len(active)))
+        wrong_meaning[(~correct) & (wrong_meaning + wrong_reading == 0)] = 1
+        rounds.append((at, active, at_stage, end_stage, wrong_meaning, wrong_reading))
+
+        stage[active] = end_stage
+        newly_passed = (end_stage == 5) & np.isnan(passed[active])
+        passed[active[newly_passed]] = at[newly_passed]
+        burned[active[end_stage == 9]] = at[end_stage == 9]
+        due[active] = np.where(end_stage < 9, at + np.array([0] + SRS_INTERVALS)[np.minimum(end_stage, 8)], np.inf)
+        active = active[due[active] < total_hours]
+
+    at, index, start_stage, end_stage, wrong_meaning, wrong_reading = (np.concatenate(x) for x in zip(*rounds)) \
+        if rounds else (np.zeros(0, dtype=int) for _ in range(6))
+    order = np.argsort(at, kind="stable")
+    reviews = np.zeros(len(order), dtype=REVIEW_DTYPE)
+    reviews["timestamp"] = np.datetime64(start, "us") + (at[order] * 3600e6).astype("m8[us]")
+    reviews["subject_id"] = subject_ids[index[order]]
+    reviews["subject_type"] = type_code[index[order]]
+    reviews["starting_srs_stage"] = start_stage[order]
+    reviews["ending_srs_stage"] = end_stage[order]
+    reviews["incorrect_meaning_answers"] = wrong_meaning[order]
+    reviews["incorrect_reading_answers"] = wrong_reading[order]
+
+    created = datetime.datetime(start.year - 1, 1, 1)
+    subjects = [
+        {"id": i, "object": SUBJECT_TYPES[t], "data_updated_at": created,
+         "data": {"level": level % 60 + 1, "characters": f"{SUBJECT_TYPES[t]} {i}"}}
+        for i, t, level in zip(subject_ids.tolist(), type_code.tolist(), level_of.tolist())
+    ]
+
+    unlocked_at = _dates(start, level_hours[level_of])
+    started_at = _dates(start, started)
+    passed_at = _dates(start, passed)
+    burned_at = _dates(start, burned)
+    available_at = _dates(start, np.where(stage < 9, due, np.nan))
+    assignments = [
+        {"id": 1000000 + i, "object": "assignment", "data_updated_at": started_at[k],
+         "data": {"created_at": unlocked_at[k], "subject_id": i, "subject_type": SUBJECT_TYPES[t], "srs_stage": s,
+                  "unlocked_at": unlocked_at[k], "started_at": started_at[k], "passed_at": passed_at[k],
+                  "burned_at": burned_at[k], "available_at": available_at[k], "resurrected_at": None,
+                  "hidden": False}}
+        for k, (i, t, s) in enumerate(zip(subject_ids.tolist(), type_code.tolist(), stage.tolist()))
+    ]
+
+    level_dates = _dates(start, level_hours)
+    level_progressions = [
+        {"id": level + 1, "object": "level_progression", "data_updated_at": level_dates[level],
+         "data": {"level": level % 60 + 1, "unlocked_at": level_dates[level], "started_at": level_dates[level],
+                  "passed_at": level_dates[level + 1] if level + 1 < len(level_dates) else None}}
+        for level in range(len(level_dates))
+    ]
+
+    return {
+        "subjects": subjects,
+        "reviews": reviews,
+        "assignments": assignments,
+        "level_progressions": level_progressions,
+        "end": start + datetime.timedelta(hours=total_hours),
+    }
+
+
+def review_documents(reviews):
+    # The reviews in the shape they are stored in the local cache, for code that works on the documents
+    return [
+        {"id": k + 1, "object": "review", "data_updated_at": t,
+         "data": {"created_at": t, "subject_id": s, "starting_srs_stage": a, "ending_srs_stage": b,
+                  "incorrect_meaning_answers": m, "incorrect_reading_answers": r}}
+        for k, (t, s, _, a, b, m, r) in enumerate(reviews.tolist())
+    ]
@@ -0,0 +1,41 @@
+import copy
+import json
+
+import numpy as np
+
+import synthetic
+from assignment_archive import ASSIGNMENT_DTYPE, append_pages, project, reproject, upsert
+
+
+def as_api(documents):
+    # The cached documents with their times as the API sends them
+    return json.loads(json.dumps(documents, default=lambda d: d.isoformat() + "Z"))
+
+
+def test_reproject_matches_incremental_upserts(tmp_path):
+    assignments = as_api(synthetic.generate(years=1, seed=0)["assignments"])
+    log_path = str(tmp_path / "assignments.log.gz")
+
+    # Every poll has new assignments plus changes of ones from earlier polls, spread over two pages
+    rng = np.random.default_rng(0)
+    projection = np.zeros(0, dtype=ASSIGNMENT_DTYPE)
+    seen = []
+    for poll, part in enumerate(np.array_split(np.arange(len(assignments)), 4)):
+        changed = []
+        for i in rng.choice(len(seen), size=min(len(seen), 200), replace=False):
+            document = copy.deepcopy(seen[i])
+            document["data"]["srs_stage"] = int(rng.integers(0, 10))
+            changed.append(document)
+        items = [assignments[i] for i in part] + changed
+        seen.extend(assignments[i] for i in part)
+        half = len(items) // 2
+        data_updated_at = f"2024-01-0{poll + 1}T00:00:00.000000Z"
+        pages = [{"data": items[:half], "data_updated_at": data_updated_at},
+                 {"data": items[half:], "data_updated_at": data_updated_at}]
+        append_pages(log_path, pages, f"2024-01-0{poll + 1}T00:00:00")
+        projection = upsert(projection, project(items))
+
+    rebuilt, data_updated_at = reproject(log_path)
+    assert rebuilt.tobytes() == projection.tobytes()
+    assert data_updated_at == "2024-01-04T00:00:00.000000Z"
+    assert len(rebuilt) == len(assignments)
@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import urllib3
+
+from data_collector import Collector
+from fetcher import RateLimiter, fetch_collection
+
+
+def page(items, data_updated_at, next_url=None):
+    return {"data": items, "data_updated_at": data_updated_at, "pages": {"next_url": next_url}}
+
+
+def assignment(assignment_id, srs_stage, data_updated_at):
+    return {"id": assignment_id, "object": "assignment", "data_updated_at": data_updated_at,
+            "data": {"subject_id": assignment_id, "subject_type": "kanji", "srs_stage": srs_stage,
+                     "unlocked_at": None, "started_at": None, "passed_at": None, "burned_at": None,
+                     "available_at": None}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # The server's respond(path, headers) gives (status, headers, body or None) for every request
+        self.server.requests.append((time.time(), self.path, dict(self.headers)))
+        status, headers, body = self.server.respond(self.path, self.headers)
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def collector(server, tmp_path):
+    return Collector("token", api_url=server.url,
+                     log_file=str(tmp_path / "assignments.log.gz"),
+                     projection_file=str(tmp_path / "assignments.npz"),
+                     validators_file=str(tmp_path / "out_ass_etags.json"),
+                     store=str(tmp_path / "wanikani_perf.snapshots"),
+                     assignments_file=str(tmp_path / "out_ass.json"),
+                     http=urllib3.PoolManager())
+
+
+def test_etag_round_trip(server, collector):
+    updated_at = "2024-01-01T00:00:00.000000Z"
+    changes_url = f"/assignments?updated_after={updated_at}"
+
+    def respond(path, headers):
+        if path == "/assignments":
+            return 200, {"ETag": '"all"'}, page([assignment(1, 3, updated_at)], updated_at)
+        if headers.get("If-None-Match") == '"changes"':
+            return 304, {}, None
+        return 200, {"ETag": '"changes"'}, page([], None)
+
+    server.respond = respond
+    collector.poll()
+    # The validators are keyed by the URL, the first poll's ETag is not sent for the changes since then
+    collector.poll()
+    assert collector.validators["assignments"] == {"url": server.url + changes_url, "etag": '"changes"',
+                                                   "last_modified": None}
+    assignments, validators = collector.assignments.copy(), dict(collector.validators)
+    counts = collector.poll()
+
+    assert [(p, h.get("If-None-Match")) for _, p, h in server.requests] == [
+        ("/assignments", None), (changes_url, None), (changes_url, '"changes"')]
+    assert collector.assignments.tobytes() == assignments.tobytes()
+    assert collector.validators == validators
+    assert collector.data_updated_at == updated_at
+    assert counts[1, 3] == 1
+    assert len(collector.pages) == 1
+
+
+def test_rate_limit_reset_after_429(server):
+    reset = int(time.time()) + 1
+
+    def respond(path, headers):
+        if len(server.requests) == 1:
+            return 429, {"RateLimit-Remaining": "0", "RateLimit-Reset": str(reset)}, None
+        return 200, {"RateLimit-Remaining": "59", "RateLimit-Reset": str(reset + 60)}, page([{"id": 1}], None)
+
+    server.respond = respond
+    items = fetch_collection(urllib3.PoolManager(), RateLimiter(), "token", server.url + "/reviews")
+    assert items == [{"id": 1}]
+    assert len(server.requests) == 2
+    assert server.requests[1][0] >= reset
+
+
+def test_failed_poll_leaves_state(server, collector):
+    updated_at = "2024-01-01T00:00:00.000000Z"
+    server.respond = lambda path, headers: (200, {"ETag": '"all"'}, page([assignment(1, 3, updated_at)], updated_at))
+    collector.poll()
+    assignments, validators, pages = collector.assignments.copy(), dict(collector.validators), list(collector.pages)
+
+    def respond(path, headers):
+        # The first page of the changes comes through, the second fails
+        if "page_after_id" in path:
+            return 500, {}, None
+        return 200, {"ETag": '"changes"'}, page([assignment(1, 4, "2024-01-02T00:00:00.000000Z")], None,
+                                              server.url + path + "&page_after_id=1")
+
+    server.respond = respond
+    with pytest.raises(urllib3.exceptions.HTTPError):
+        collector.poll()
+    assert collector.assignments.tobytes() == assignments.tobytes()
+    assert collector.validators == validators
+    assert collector.pages == pages
+    assert collector.data_updated_at == updated_at
+    assert len(collector.snapshots) == 1
@@ -0,0 +1,200 @@
+import datetime
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+import range_index
+import review_checkpoint
+import review_shards
+import srs_timeline
+import synthetic
+from review_aggregation import ANSWER_KINDS, SUBJECT_TYPES, aggregate_reviews, stage_history, time_in_stage
+
+
+def legacy_aggregate(reviews):
+    # The dict based loop charter_v2.main ran over the review documents before it was vectorized
+    hourly_data = defaultdict(lambda: defaultdict(dict))
+    hourly_answer_ratio = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    subject_spent_on_stage = defaultdict(lambda: defaultdict(float))
+    subject_previous_completion = dict()
+    weekly_wrong_answers_by_starting_level = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    weekly_correct_answers_by_starting_level = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    daily_level_change = defaultdict(lambda: defaultdict(int))
+    daily_review_count = defaultdict(lambda: defaultdict(int))
+    for r in reviews.tolist():
+        timestamp, subject_id, type_code, starting_srs_stage, ending_srs_stage, incorrect_meaning, incorrect_reading = r
+        date_and_hour = timestamp.replace(minute=0, second=0, microsecond=0)
+        date = date_and_hour - datetime.timedelta(hours=date_and_hour.hour)
+        object_type = SUBJECT_TYPES[type_code]
+        week = (date_and_hour.isocalendar().year, date_and_hour.isocalendar().week)
+
+        hourly_data[object_type][date_and_hour][subject_id] = ending_srs_stage
+        hourly_answer_ratio[object_type][date_and_hour]["meaning_answers"] += incorrect_meaning + 1
+        hourly_answer_ratio[object_type][date_and_hour]["incorrect_meaning_answers"] += incorrect_meaning
+        hourly_answer_ratio[object_type][date_and_hour]["reading_answers"] += incorrect_reading + 1
+        hourly_answer_ratio[object_type][date_and_hour]["incorrect_reading_answers"] += incorrect_reading
+
+        if starting_srs_stage >= ending_srs_stage:
+            weekly_wrong_answers_by_starting_level[object_type][week][starting_srs_stage] += 1
+        else:
+            weekly_correct_answers_by_starting_level[object_type][week][starting_srs_stage] += 1
+
+        if subject_id in subject_previous_completion:
+            subject_spent_on_stage[subject_id][starting_srs_stage] \
+                += (date_and_hour - subject_previous_completion[subject_id]).total_seconds() / 60
+        subject_previous_completion[subject_id] = date_and_hour
+
+        daily_review_count[object_type][date] += 1
+        daily_level_change[object_type][date] += ending_srs_stage - starting_srs_stage
+
+    accumulated = dict()
+    for t in SUBJECT_TYPES:
+        accumulated[t] = dict()
+        current_states = dict()
+        for k in sorted(hourly_data[t].keys()):
+            totals = [0 for x in range(10)]
+            for subject_id, srs_stage in hourly_data[t][k].items():
+                current_states[subject_id] = srs_stage
+            for stage in current_states.values():
+                totals[stage] += 1
+            accumulated[t][k] = totals
+
+    accumulated_accuracy = dict()
+    for t in SUBJECT_TYPES:
+        accumulated_accuracy[t] = defaultdict(lambda: defaultdict(int))
+        for k in sorted(hourly_answer_ratio[t].keys()):
+            for answer_type in ANSWER_KINDS:
+                accumulated_accuracy[t][(k.isocalendar().year, k.isocalendar().week)][answer_type] \
+                    += hourly_answer_ratio[t][k][answer_type]
+
+    return {
+        "hourly_answer_ratio": hourly_answer_ratio,
+        "daily_level_change": daily_level_change,
+        "daily_review_count": daily_review_count,
+        "accumulated_accuracy": accumulated_accuracy,
+        "weekly_correct": weekly_correct_answers_by_starting_level,
+        "weekly_wrong": weekly_wrong_answers_by_starting_level,
+        "subject_spent_on_stage": subject_spent_on_stage,
+        "accumulated": accumulated,
+    }
+
+
+# The results of legacy_aggregate that aggregate_reviews computes, the others come from the per subject state
+AGGREGATE_RESULTS = ["hourly_answer_ratio", "daily_level_change", "daily_review_count", "accumulated_accuracy",
+                     "weekly_correct", "weekly_wrong"]
+
+
+def as_legacy(aggregates, stage_time, histories):
+    # The vectorized results in the nested dict form of legacy_aggregate, with only the non-empty entries
+    converted = {k: dict() for k in AGGREGATE_RESULTS + ["accumulated"]}
+    for i, t in enumerate(SUBJECT_TYPES):
+        history_hours, counts = histories[i]
+        converted["accumulated"][t] = dict(zip(history_hours.astype(datetime.datetime), counts.tolist()))
+    converted["subject_spent_on_stage"] = {
+        subject_id: {s: spent[s] for s in np.flatnonzero(spent)}
+        for subject_id, spent in zip(stage_time["subject_ids"].tolist(), stage_time["spent"])}
+    if aggregates is None:
+        return converted
+
+    hours = aggregates["hours"].astype(datetime.datetime)
+    days = aggregates["days"].astype("M8[h]").astype(datetime.datetime)
+    weeks = [(d.isocalendar().year, d.isocalendar().week) for d in aggregates["weeks"].astype(datetime.date)]
+    for i, t in enumerate(SUBJECT_TYPES):
+        converted["hourly_answer_ratio"][t] = {
+            hours[h]: dict(zip(ANSWER_KINDS, aggregates["hourly_answers"][h, i].tolist()))
+            for h in np.flatnonzero(aggregates["hourly_count"][:, i])}
+        reviewed = np.flatnonzero(aggregates["daily_count"][:, i])
+        converted["daily_level_change"][t] = {days[d]: aggregates["daily_level_change"][d, i] for d in reviewed}
+        converted["daily_review_count"][t] = {days[d]: aggregates["daily_count"][d, i] for d in reviewed}
+        converted["accumulated_accuracy"][t] = {
+            weeks[w]: dict(zip(ANSWER_KINDS, aggregates["weekly_answers"][w, i].tolist()))
+            for w in np.flatnonzero(aggregates["weekly_count"][:, i])}
+        for k in ["weekly_correct", "weekly_wrong"]:
+            converted[k][t] = {weeks[w]: {s: aggregates[k][w, i, s] for s in np.flatnonzero(aggregates[k][w, i])}
+                               for w in np.flatnonzero(aggregates[k][:, i].any(axis=1))}
+    return converted
+
+
+def assert_matches_legacy(legacy, aggregates, stage_time, histories):
+    # Without aggregates only the per subject state is compared
+    converted = as_legacy(aggregates, stage_time, histories)
+    for k, expected in legacy.items():
+        if aggregates is None and k in AGGREGATE_RESULTS:
+            continue
+        if k == "subject_spent_on_stage":
+            # The legacy loop also has entries for spans of zero minutes
+            expected = {subject_id: {s: m for s, m in spent.items() if m} for subject_id, spent in expected.items()}
+            expected = {subject_id: spent for subject_id, spent in expected.items() if spent}
+            converted[k] = {subject_id: spent for subject_id, spent in converted[k].items() if spent}
+        else:
+            expected = {t: {key: dict(v) if isinstance(v, dict) else v for key, v in values.items()}
+                        for t, values in expected.items()}
+            expected = {t: expected.get(t, dict()) for t in SUBJECT_TYPES}
+        if k in ["weekly_correct", "weekly_wrong"]:
+            expected = {t: {w: {s: n for s, n in v.items() if n} for w, v in values.items()}
+                        for t, values in expected.items()}
+        assert converted[k] == expected, k
+
+
+@pytest.fixture(scope="module")
+def reviews():
+    return synthetic.generate(years=1, seed=0)["reviews"]
+
+
+@pytest.fixture(scope="module")
+def legacy(reviews):
+    return legacy_aggregate(reviews)
+
+
+def test_aggregate_reviews_matches_legacy(reviews, legacy):
+    histories = [stage_history(reviews, i) for i in range(len(SUBJECT_TYPES))]
+    assert_matches_legacy(legacy, aggregate_reviews(reviews), time_in_stage(reviews), histories)
+
+
+def test_checkpoint_update_matches_legacy(reviews, legacy):
+    # Split in the middle of hours, so that the same hour is in two updates
+    first, *rest = np.array_split(reviews, 5)
+    state = review_checkpoint.build(first, "", workers=1)
+    for part in rest:
+        state = review_checkpoint.update(state, part)
+    assert_matches_legacy(legacy, None, state["time_in_stage"], state["histories"])
+
+
+def test_shards_match_legacy(reviews, legacy):
+    state = review_shards.aggregate(reviews, workers=2, shards=4)
+    assert_matches_legacy(legacy, None, state["time_in_stage"], state["histories"])
+
+
+def test_range_index_matches_aggregate_reviews(reviews):
+    # The daily and weekly sums the checkpoint used to keep now come from the incrementally extended range index
+    first, *rest = np.array_split(reviews, 5)
+    index = range_index.build(first, "")
+    for part in rest:
+        index = range_index.extend(index, part)
+    window = range_index.window_aggregates(index)
+    aggregates = aggregate_reviews(reviews)
+    for k, v in window.items():
+        np.testing.assert_array_equal(v, aggregates[k], err_msg=k)
+
+
+def test_timeline_extended_out_of_order_matches_build(reviews):
+    subject_types = np.full(int(reviews["subject_id"].max()) + 1, -1, dtype=np.int8)
+    subject_types[reviews["subject_id"]] = reviews["subject_type"]
+    events = srs_timeline.review_events(reviews)
+    built = srs_timeline.build(events, subject_types)
+
+    # Pieces in a random order, so that most extends insert before events already in the timeline
+    pieces = np.array_split(events, 7)
+    timeline = srs_timeline.build(pieces[0][:0], subject_types)
+    for i in np.random.default_rng(0).permutation(len(pieces)):
+        timeline = srs_timeline.extend(timeline, pieces[i])
+    np.testing.assert_array_equal(timeline["events"]["time"], built["events"]["time"])
+
+    for t in range(len(SUBJECT_TYPES)):
+        hours, counts = stage_history(reviews, t)
+        # The counts at the end of every tenth hour with reviews
+        for hour, expected in zip(hours[::10], counts[::10]):
+            end = hour + np.timedelta64(1, "h") - np.timedelta64(1, "us")
+            np.testing.assert_array_equal(srs_timeline.counts_at(timeline, end)[t], expected)
+            np.testing.assert_array_equal(srs_timeline.counts_at(built, end)[t], expected)
@@ -0,0 +1,51 @@
+import datetime
+
+import numpy as np
+
+# Fields that are on the documents themselves instead of in their "data"
+TOP_LEVEL_FIELDS = {"id", "object", "url", "data_updated_at"}
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_NAT = np.iinfo(np.int64).min
+
+
+def _microseconds(value):
+    if value is None:
+        return _NAT
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def parse_timestamps(values):
+    """
+    ISO 8601 strings or datetimes, None where missing, as a naive UTC datetime64[us] array (NaT where missing).
+    Going through integer microseconds is several times faster than letting NumPy convert the datetime objects.
+    """
+    values = list(values)
+    return np.fromiter(map(_microseconds, values), dtype=np.int64, count=len(values)).view("M8[us]")
+
+
+def week_start(days):
+    days = days.astype("M8[D]")
+    # 1970-01-01 was a Thursday, so this is 0 for Mondays
+    weekday = (days.astype(np.int64) + 3) % 7
+    return days - weekday.astype("m8[D]")
+
+
+def iso_year_week(days):
+    thursday = week_start(days) + np.timedelta64(3, "D")
+    year = thursday.astype("M8[Y]")
+    week = (thursday - year.astype("M8[D]")).astype(np.int64) // 7 + 1
+    return year.astype(np.int64) + 1970, week
+
+
+def time_column(records, field):
+    # A time field of a list of documents as a datetime64[us] array, NaT where it is not set
+    if field in TOP_LEVEL_FIELDS:
+        return parse_timestamps([r[field] for r in records])
+    return parse_timestamps([r["data"][field] for r in records])